@@ -0,0 +1,296 @@
+import numpy as np
+
+'''
+A vectorised version of the 10-armed testbed from chapter 2 of Reinforcement Learning - An Introduction
+(Sutton & Barto). Instead of running each of the 2000 runs one after another with a Python call per step,
+every run is held as a row of a (runs x k) array and all of the runs are advanced together in a single step.
+'''
+
+class BanditProblem:
+    '''
+    k is the number of actions and runs is the number of independent problems held at once.
+    Each run gets its own set of expected rewards, drawn from a unit normal distribution.
+    '''
+    def __init__(self, k, runs=1, seed=None):
+        self.size = k
+        self.runs = runs
+        self.rng = np.random.default_rng(seed)
+        self._rows = np.arange(runs)
+        self.reset()
+
+    '''
+    Takes an array holding one action for each run and returns an array of the rewards obtained
+    '''
+    def action(self, a):
+        return self.rng.normal(self.expected_rewards[self._rows, a], 1)
+
+    '''
+    Nonstationary problems: every expected reward takes an independent random walk step
+    '''
+    def random_update_rewards(self, variance):
+        self.expected_rewards += self.rng.normal(0, variance, size=self.expected_rewards.shape)
+
+    '''
+    Returns a boolean array marking, for each run, which of the given actions are optimal
+    '''
+    def is_optimal(self, a):
+        best = self.expected_rewards.max(axis=1)
+        return self.expected_rewards[self._rows, a] == best
+
+    def reset(self):
+        self.expected_rewards = self.rng.normal(0, 1, size=(self.runs, self.size))
+
+class BanditAgent:
+    '''
+    Holds the value estimates for every run of a testbed.
+    initial: the initial estimate of every action (set this above 0 for optimistic initial values)
+    epsilon: the probability of selecting a random action
+    c: the degree of exploration for UCB action selection. Leave as None to use (epsilon-)greedy selection.
+    alpha: the constant step size. Leave as None to use sample averages.
+    Ties between apparently optimal actions are always broken randomly.
+    '''
+    def __init__(self, k, runs=1, initial=0, epsilon=0, c=None, alpha=None, seed=None):
+        self.size = k
+        self.runs = runs
+        self.initial = initial
+        self.epsilon = epsilon
+        self.c = c
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        self._rows = np.arange(runs)
+        self.reset()
+
+    def reset(self):
+        self.estimates = np.full((self.runs, self.size), self.initial, dtype=float)
+        self.times_selected = np.zeros((self.runs, self.size), dtype=np.int64)
+        self.t = 0
+
+    '''
+    Returns the index of the maximum of each row, picking randomly between tied maxima.
+    Random keys are drawn for every entry and only the keys of the maximal entries are kept,
+    so the argmax of the keys is a uniformly random choice among the ties.
+    '''
+    def _argmax(self, values):
+        ties = values == values.max(axis=1, keepdims=True)
+        return np.argmax(np.where(ties, self.rng.random(values.shape), -1), axis=1)
+
+    def greedy_select(self):
+        return self._argmax(self.estimates)
+
+    def epsilon_greedy_select(self):
+        actions = self.greedy_select()
+        if self.epsilon > 0:
+            explore = self.rng.random(self.runs) < self.epsilon
+            actions[explore] = self.rng.integers(0, self.size, size=np.count_nonzero(explore))
+        return actions
+
+    '''
+    Actions that haven't been selected yet are treated as maximising actions
+    '''
+    def ucb_select(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bonus = self.c * np.sqrt(np.log(self.t) / self.times_selected)
+        ucbs = np.where(self.times_selected == 0, np.inf, self.estimates + bonus)
+        return self._argmax(ucbs)
+
+    '''
+    Select one action for each run using the configured selection method
+    '''
+    def select(self):
+        self.t += 1
+        if self.c is not None:
+            return self.ucb_select()
+        return self.epsilon_greedy_select()
+
+    '''
+    Update the estimates of the selected actions given the rewards obtained
+    '''
+    def update(self, a, r):
+        self.times_selected[self._rows, a] += 1
+        if self.alpha is None:
+            step_size = 1 / self.times_selected[self._rows, a]
+        else:
+            step_size = self.alpha
+        self.estimates[self._rows, a] += (r - self.estimates[self._rows, a]) * step_size
+
+class BanditStats:
+    '''
+    Streaming statistics of a testbed's rewards and optimal actions, added a step at a time for a batch of runs at
+    once, so nothing is kept per run. For every step it holds the number of rewards, their running mean and
+    variance, and the number of optimal actions, which is O(steps) memory however many runs are added.
+    window: optionally, also keep the same totals over all of the last window steps together.
+    per_step: set to false to only keep the window's totals, so the statistics take O(1) memory (run_testbed still
+    returns its per-step averages). The per-step methods then raise a ValueError.
+    Means and variances are combined with the pairwise update of Chan et al., so batches can be of any size, and
+    stats from separate batches of runs (e.g. from separate processes) can be merged.
+    '''
+    def __init__(self, steps, window=None, per_step=True):
+        self.steps = steps
+        self.window = window
+        self.per_step = per_step
+        if per_step:
+            self.counts = np.zeros(steps)
+            self.means = np.zeros(steps)
+            self._m2s = np.zeros(steps)
+            self.optimal = np.zeros(steps)
+        # Totals over the window: count, mean, sum of squared deviations and optimal actions
+        self._window = [0, 0.0, 0.0, 0]
+
+    '''
+    Combine a count, mean and sum of squared deviations with another. Works on numbers or arrays.
+    '''
+    @staticmethod
+    def _combine(count, mean, m2, other_count, other_mean, other_m2):
+        total = count + other_count
+        delta = other_mean - mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_mean = np.where(total > 0, mean + delta * other_count / total, 0)
+            new_m2 = np.where(total > 0, m2 + other_m2 + delta ** 2 * count * other_count / total, 0)
+        return total, new_mean, new_m2
+
+    '''
+    Add the rewards obtained at step t (counting from 0) and whether the actions were optimal, as arrays with
+    one entry for each run in the batch
+    '''
+    def add(self, t, rewards, optimal):
+        n = len(rewards)
+        mean = rewards.mean()
+        m2 = ((rewards - mean) ** 2).sum()
+        n_optimal = np.count_nonzero(optimal)
+        if self.per_step:
+            self.counts[t], self.means[t], self._m2s[t] = self._combine(self.counts[t], self.means[t],
+                                                                        self._m2s[t], n, mean, m2)
+            self.optimal[t] += n_optimal
+        if self.window is not None and t >= self.steps - self.window:
+            count, window_mean, window_m2, window_optimal = self._window
+            count, window_mean, window_m2 = self._combine(count, window_mean, window_m2, n, mean, m2)
+            self._window = [count, float(window_mean), float(window_m2), window_optimal + n_optimal]
+
+    def _check_per_step(self):
+        if not self.per_step:
+            raise ValueError("These BanditStats only keep the window's totals (per_step=False)")
+
+    '''
+    Add the statistics of another BanditStats over the same steps and window to these
+    '''
+    def merge(self, other):
+        if (self.steps, self.window, self.per_step) != (other.steps, other.window, other.per_step):
+            raise ValueError("Only BanditStats with the same steps, window and per_step can be merged")
+        if self.per_step:
+            self.counts, self.means, self._m2s = self._combine(self.counts, self.means, self._m2s,
+                                                               other.counts, other.means, other._m2s)
+            self.optimal += other.optimal
+        count, mean, m2 = self._combine(*self._window[:3], *other._window[:3])
+        self._window = [count, float(mean), float(m2), self._window[3] + other._window[3]]
+
+    '''
+    The variance of the rewards at each step, across the runs
+    '''
+    def variances(self):
+        self._check_per_step()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.counts > 1, self._m2s / (self.counts - 1), 0)
+
+    '''
+    The standard error of the mean reward at each step
+    '''
+    def standard_errors(self):
+        self._check_per_step()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.counts > 0, np.sqrt(self.variances() / self.counts), 0)
+
+    '''
+    The fraction of runs that selected an optimal action at each step
+    '''
+    def optimal_fractions(self):
+        self._check_per_step()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.counts > 0, self.optimal / self.counts, 0)
+
+    '''
+    The average reward over the n steps up to and including each step (fewer for the first n - 1 steps)
+    '''
+    def moving_average(self, n):
+        self._check_per_step()
+        sums = np.cumsum(self.means)
+        sums[n:] = sums[n:] - sums[:-n]
+        return sums / np.minimum(np.arange(1, self.steps + 1), n)
+
+    '''
+    The mean reward, its variance and the fraction of optimal actions over all of the last window steps
+    '''
+    def window_mean(self):
+        return self._window[1]
+
+    def window_variance(self):
+        count, _, m2, _ = self._window
+        return m2 / (count - 1) if count > 1 else 0
+
+    def window_optimal_fraction(self):
+        count, _, _, optimal = self._window
+        return optimal / count if count > 0 else 0
+
+'''
+Runs a complete testbed. agent_args are passed on to BanditAgent (e.g. epsilon=0.1).
+walk: the standard deviation of the random walk taken by the expected rewards each step,
+leave as None for a stationary problem.
+stats: optionally a BanditStats, which every step's rewards and optimal actions are added to.
+Returns the average reward at each step and the fraction of runs that selected an optimal action at each step.
+'''
+def run_testbed(runs, steps, k=10, walk=None, seed=None, stats=None, **agent_args):
+    seeds = np.random.SeedSequence(seed).spawn(2)
+    problem = BanditProblem(k, runs, seed=seeds[0])
+    agent = BanditAgent(k, runs, seed=seeds[1], **agent_args)
+    average_rewards = np.zeros(steps)
+    optimal_actions = np.zeros(steps)
+    for t in range(steps):
+        if walk is not None:
+            problem.random_update_rewards(walk)
+        a = agent.select()
+        r = problem.action(a)
+        agent.update(a, r)
+        optimal = problem.is_optimal(a)
+        average_rewards[t] = r.mean()
+        optimal_actions[t] = optimal.mean()
+        if stats is not None:
+            stats.add(t, r, optimal)
+    return average_rewards, optimal_actions
+
+'''
+Runs a testbed of any number of runs in batches of batch_size runs, so that the memory used only depends on the
+batch size and the number of steps. Each batch is seeded from its own child of seed.
+window and per_step are passed on to BanditStats. Returns the BanditStats of all of the runs.
+'''
+def run_testbed_stats(runs, steps, k=10, walk=None, seed=None, batch_size=2000, window=None, per_step=True,
+                      **agent_args):
+    stats = BanditStats(steps, window, per_step)
+    batches = range(0, runs, batch_size)
+    for first, batch_seed in zip(batches, np.random.SeedSequence(seed).spawn(len(batches))):
+        run_testbed(min(batch_size, runs - first), steps, k, walk, int(batch_seed.generate_state(1)[0]), stats,
+                    **agent_args)
+    return stats
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    import time
+
+    # Reproduce the comparison of greedy and epsilon-greedy methods from the notebook
+    runs = 2000
+    steps = 1000
+    for label, args in [("greedy", {}),
+                        ("epsilon = 0.01", {'epsilon': 0.01}),
+                        ("epsilon = 0.1", {'epsilon': 0.1}),
+                        ("e = 0, Q1 = 5", {'initial': 5}),
+                        ("ucb, c = 2", {'c': 2})]:
+        t = time.time()
+        average_rewards, _ = run_testbed(runs, steps, seed=0, **args)
+        print(f"{label}: {round(time.time() - t, 2)}s")
+        plt.plot(range(1, steps + 1), average_rewards, label=label, linewidth=1)
+
+    plt.xlabel('Time Step')
+    plt.ylabel('Average Reward')
+    plt.title('Average Reward over Time')
+    plt.legend()
+    plt.grid(True)
+    plt.ylim(0, 2)
+    plt.show()
@@ -0,0 +1,114 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+from bandit_testbed import BanditStats, run_testbed
+
+'''
+A runner for parameter studies like the one in the summary exercise (Exercise 2.11) of Reinforcement Learning -
+An Introduction (Sutton & Barto). Every job is a (method, parameter, seeds) tuple and owns its own BanditProblem and
+estimates, so jobs can be spread over a process pool. A job runs all of its seeds together as the rows of one
+vectorised testbed, since a testbed of a single run pays numpy's overhead on every step for very little work.
+Each job is seeded from its own seeds alone, so the results are the same no matter how many workers are used or the
+order in which the jobs finish.
+'''
+
+'''
+Maps each method name onto the BanditAgent arguments that the parameter controls
+'''
+def agent_args(method, parameter):
+    if method == 'e-greedy':
+        return {'epsilon': parameter}
+    if method == 'optimistic':
+        return {'initial': parameter}
+    if method == 'ucb':
+        return {'c': parameter}
+    raise ValueError(f"Unknown method {method}")
+
+'''
+Runs a single job, with a run for each of its seeds, and returns the average reward over the last measured_steps
+steps of all of the runs.
+The defaults match the summary exercise: a nonstationary problem, constant step size of 0.1,
+200000 steps and the average taken over the last 100000 steps.
+'''
+def run_job(job, steps=200000, measured_steps=100000, k=10, walk=0.01, alpha=0.1):
+    method, parameter, seeds = job
+    stats = BanditStats(steps, window=measured_steps, per_step=False)
+    run_testbed(len(seeds), steps, k=k, walk=walk, seed=list(seeds), alpha=alpha, stats=stats,
+                **agent_args(method, parameter))
+    return stats.window_mean()
+
+'''
+Builds the list of jobs for every combination of method and parameter.
+parameters: a dict mapping a method name to the list of parameters to try for it
+seeds_per_job: the number of seeds run together in each job. By default a job runs all of the seeds, but smaller
+groups give more jobs to spread over the workers when there are few parameters.
+'''
+def make_jobs(parameters, seeds, seeds_per_job=None):
+    seeds = list(seeds)
+    seeds_per_job = seeds_per_job or len(seeds)
+    groups = [tuple(seeds[i:i + seeds_per_job]) for i in range(0, len(seeds), seeds_per_job)]
+    return [(method, parameter, group) for method in parameters
+                                       for parameter in parameters[method]
+                                       for group in groups]
+
+'''
+Runs the jobs across a pool of worker processes (one per core by default) and collects the results as they complete.
+Returns a dict mapping each job to its result. Any other arguments are passed on to run_job.
+'''
+def run_study(jobs, workers=None, verbose=False, **job_args):
+    workers = workers or os.cpu_count()
+    results = dict()
+    t = time.time()
+    if workers == 1:
+        # Run in this process, which is easier to debug
+        for job in jobs:
+            results[job] = run_job(job, **job_args)
+            if verbose:
+                print(f"{len(results)}/{len(jobs)} jobs done, {round(time.time() - t, 2)}s", end='\r')
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(partial(run_job, **job_args), job): job for job in jobs}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if verbose:
+                    print(f"{len(results)}/{len(jobs)} jobs done, {round(time.time() - t, 2)}s", end='\r')
+    if verbose:
+        print()
+    return results
+
+'''
+Averages the results over the seeds, giving a dict mapping each method to a list of averages (one per parameter).
+Each job's result is weighted by its number of seeds.
+'''
+def summarise(parameters, results):
+    summary = dict()
+    for method in parameters:
+        summary[method] = []
+        for parameter in parameters[method]:
+            jobs = [job for job in results if job[:2] == (method, parameter)]
+            summary[method].append(np.average([results[job] for job in jobs], weights=[len(job[2]) for job in jobs]))
+    return summary
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    parameters = {
+        'e-greedy': [2 ** x for x in range(-7, -1)],
+        'optimistic': [2 ** x for x in range(-2, 3)],
+        'ucb': [2 ** x for x in range(-4, 3)],
+    }
+    jobs = make_jobs(parameters, seeds=range(4))
+    results = run_study(jobs, verbose=True)
+    summary = summarise(parameters, results)
+
+    for method in parameters:
+        plt.semilogx(parameters[method], summary[method], label=method, linewidth=1)
+    plt.xlabel('parameter')
+    plt.ylabel('Average reward over last 100000 steps')
+    plt.legend()
+    plt.grid(True)
+    plt.show()
@@ -0,0 +1,536 @@
+import hashlib
+import math
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+'''
+Jack's car rental (Example 4.2 of Reinforcement Learning - An Introduction, Sutton & Barto) solved with policy iteration.
+In the notebook, state_action_value loops over every combination of rentals and returns for every state and action
+in every sweep, even though the dynamics never change. Here the dynamics are turned into a model once: the expected
+immediate reward and the transition matrix for each of the car-moving actions. A sweep is then a matrix-vector product.
+
+A state is (cars at location 1, cars at location 2), and the value and policy tables are (max_cars + 1) x (max_cars + 1)
+arrays indexed in the same way. An action is the number of cars moved from location 1 to location 2 overnight
+(negative to move cars the other way).
+'''
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.model_cache')
+
+def poisson(n, lambd):
+    return (math.exp(-lambd) * lambd**n) / math.factorial(n)
+
+class CarRentalModel:
+    '''
+    Builds (or loads from the cache) the model of the problem.
+    request_lambdas and return_lambdas are the expected numbers of rentals and returns at each location.
+    cache_dir: the directory in which models are cached, keyed by their parameters. Set to None to disable caching.
+    '''
+    def __init__(self, max_cars=20, request_lambdas=(3, 4), return_lambdas=(3, 2), move_cost=2, rent_reward=10,
+                 max_move=5, gamma=0.9, cache_dir=DEFAULT_CACHE_DIR):
+        self.max_cars = max_cars
+        self.request_lambdas = tuple(request_lambdas)
+        self.return_lambdas = tuple(return_lambdas)
+        self.move_cost = move_cost
+        self.rent_reward = rent_reward
+        self.max_move = max_move
+        self.gamma = gamma
+
+        self.shape = (max_cars + 1, max_cars + 1)
+        self.n_states = self.shape[0] * self.shape[1]
+        self.actions = np.arange(-max_move, max_move + 1)
+
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f'car_rental_{self._key()}.npz')
+        if path is not None and os.path.exists(path):
+            with np.load(path) as cached:
+                self.rewards = cached['rewards']
+                self.transitions = cached['transitions']
+                self.legal = cached['legal']
+        else:
+            self._build()
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez(path, rewards=self.rewards, transitions=self.transitions, legal=self.legal)
+
+    '''
+    The cache key: a hash of every parameter that the rewards and transitions depend on
+    '''
+    def _key(self):
+        params = (self.max_cars, self.request_lambdas, self.return_lambdas, self.move_cost, self.rent_reward, self.max_move)
+        return hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+
+    '''
+    Given the number of cars at a location after cars have been moved, the distribution of the number of cars at
+    the end of the next day. Returns a matrix whose [n, m] entry is the probability of ending with m cars when
+    starting with n, and the expected number of rentals starting with n.
+    Like the notebook, rentals are limited to the cars available and returns to the free spaces, without collecting
+    the tail probabilities, so that the values stay comparable with the notebook's.
+    '''
+    def _location_dynamics(self, request_lambda, return_lambda):
+        m = self.max_cars
+        p_request = np.array([poisson(n, request_lambda) for n in range(m + 1)])
+        p_return = np.array([poisson(n, return_lambda) for n in range(m + 1)])
+        # The probability of anywhere between 0 and k cars being returned
+        p_return_cumulative = np.cumsum(p_return)
+
+        end = np.zeros((m + 1, m + 1))
+        expected_rentals = np.zeros(m + 1)
+        for n in range(m + 1):
+            for rented in range(n + 1):
+                remaining = n - rented
+                end[n, remaining:] += p_request[rented] * p_return[:m - remaining + 1]
+                expected_rentals[n] += rented * p_request[rented] * p_return_cumulative[m - remaining]
+        return end, expected_rentals
+
+    '''
+    Compute the expected immediate reward and transition matrix for every (action, state).
+    The two locations are independent once cars have been moved, so the transition probabilities
+    are the products of the per-location probabilities.
+    '''
+    def _build(self):
+        m = self.max_cars
+        loc1, loc2 = np.indices(self.shape)
+        loc1, loc2 = loc1.ravel(), loc2.ravel()
+        action = self.actions[:, None]
+        self.legal = (action <= np.minimum(loc1, self.max_move)) & (-action <= np.minimum(loc2, self.max_move))
+
+        # Move cars, clamp to max_cars (illegal moves are clamped to 0 too, but are masked out anyway)
+        moved1 = np.clip(loc1 - action, 0, m)
+        moved2 = np.clip(loc2 + action, 0, m)
+
+        end1, rentals1 = self._location_dynamics(self.request_lambdas[0], self.return_lambdas[0])
+        end2, rentals2 = self._location_dynamics(self.request_lambdas[1], self.return_lambdas[1])
+        # The total probability covered at each location (below 1 because of the truncation)
+        mass1, mass2 = end1.sum(axis=1), end2.sum(axis=1)
+
+        self.rewards = (-self.move_cost * np.abs(action) * mass1[moved1] * mass2[moved2]
+                        + self.rent_reward * (rentals1[moved1] * mass2[moved2] + mass1[moved1] * rentals2[moved2]))
+        self.transitions = np.einsum('asx,asy->asxy', end1[moved1], end2[moved2]).reshape(
+            len(self.actions), self.n_states, self.n_states)
+
+    '''
+    The expected reward vector and transition matrix of a deterministic policy
+    '''
+    def policy_model(self, policy):
+        a = policy.ravel() + self.max_move
+        s = np.arange(self.n_states)
+        return self.rewards[a, s], self.transitions[a, s]
+
+    '''
+    The value of taking every action in every state, given the state values. Illegal actions have value -inf.
+    '''
+    def action_values(self, values):
+        q = self.rewards + self.gamma * (self.transitions @ values.ravel())
+        return np.where(self.legal, q, -np.inf)
+
+'''
+Policy evaluation. There are three modes:
+'iterative': synchronous sweeps (every state is backed up from the values of the previous sweep) until the largest
+change in a sweep is less than accuracy, or the number of iterations is reached.
+'exact': solves the linear system (I - gamma * P_pi) V = r_pi directly.
+'modified': a fixed k sweeps, for modified policy iteration.
+'parallel': the same sweeps as 'iterative', split across workers processes (see ParallelSweeper).
+report: optionally a dict, which is filled with the mode, the number of sweeps, the wall time and the final
+Bellman residual (the largest change that one more sweep would make).
+'''
+def evaluate(values, policy, model, accuracy=0.001, iterations=None, verbose=False, mode='iterative', k=5, report=None,
+             workers=None):
+    if mode == 'parallel':
+        with ParallelSweeper(model, workers) as sweeper:
+            return sweeper.evaluate(values, policy, accuracy, iterations, report)
+    start = time.time()
+    r_pi, p_pi = model.policy_model(policy)
+    v = values.ravel().astype(float)
+    i = 0
+    if mode == 'exact':
+        v = np.linalg.solve(np.eye(model.n_states) - model.gamma * p_pi, r_pi)
+    elif mode == 'iterative' or mode == 'modified':
+        if mode == 'modified':
+            accuracy, iterations = 0, k
+        difference = accuracy
+        while difference >= accuracy and (iterations == None or i < iterations):
+            t = time.time()
+            new_v = r_pi + model.gamma * (p_pi @ v)
+            difference = np.max(np.abs(new_v - v))
+            v = new_v
+            if verbose:
+                print(f"diff: {round(difference, 4)}, duration: {round(time.time() - t, 4)}")
+            i += 1
+    else:
+        raise ValueError(f"Unknown evaluation mode {mode}")
+
+    if report is not None:
+        report['mode'] = mode
+        report['sweeps'] = i
+        report['time'] = time.time() - start
+        report['residual'] = np.max(np.abs(r_pi + model.gamma * (p_pi @ v) - v))
+    return v.reshape(model.shape)
+
+'''
+Policy improvement. Every state takes the action with the best value; the old action is kept if it ties with the best,
+so that the policy doesn't flip between equally good actions forever.
+'''
+def improve(policy, values, model):
+    q = model.action_values(values)
+    old = policy.ravel() + model.max_move
+    best = np.argmax(q, axis=0)
+    s = np.arange(model.n_states)
+    best = np.where(q[old, s] >= q[best, s], old, best)
+    new_policy = (best - model.max_move).reshape(model.shape)
+    policy_stable = np.array_equal(new_policy, policy)
+    return policy_stable, new_policy
+
+class IncrementalImprover:
+    '''
+    Policy improvement that keeps the value of every (action, state) between calls, so that each call only backs up
+    the entries that could have changed. An entry is recomputed when one of its successors (the states it reaches
+    with probability at least cutoff) has changed value by more than tolerance since the entries depending on it were
+    last brought up to date; every other entry keeps its cached value.
+    Cached values are therefore off by at most about gamma * tolerance, plus whatever the successors below the cutoff
+    contribute. With tolerance=0 and cutoff=0 the results are exactly those of improve.
+    '''
+    def __init__(self, model, tolerance=1e-3, cutoff=1e-6):
+        self.model = model
+        self.tolerance = tolerance
+        # For each state, which (action, state) entries reach it, flattened so a set of states is a row gather
+        self._reached_from = (model.transitions >= cutoff).transpose(2, 0, 1).reshape(model.n_states, -1)
+        self._n_legal = int(np.count_nonzero(model.legal))
+        self.q = None
+        # The value of each state when the entries depending on it were last recomputed
+        self._reference = None
+        self.backups = 0
+        self.skipped = 0
+        self.history = [] # (backups, skipped) for each call
+
+    '''
+    The same as improve(policy, values, model), returning (policy_stable, new_policy)
+    '''
+    def improve(self, policy, values):
+        model = self.model
+        v = values.ravel()
+        if self.q is None:
+            self.q = np.full(model.legal.shape, -np.inf)
+            self._reference = v.copy()
+            dirty = model.legal
+        else:
+            changed = np.flatnonzero(np.abs(v - self._reference) > self.tolerance)
+            dirty = self._reached_from[changed].any(axis=0).reshape(model.legal.shape) & model.legal
+            self._reference[changed] = v[changed]
+        a, s = np.nonzero(dirty)
+        self.q[a, s] = model.rewards[a, s] + model.gamma * (model.transitions[a, s] @ v)
+
+        backups = len(a)
+        self.backups += backups
+        self.skipped += self._n_legal - backups
+        self.history.append((backups, self._n_legal - backups))
+
+        old = policy.ravel() + model.max_move
+        best = np.argmax(self.q, axis=0)
+        s = np.arange(model.n_states)
+        best = np.where(self.q[old, s] >= self.q[best, s], old, best)
+        new_policy = (best - model.max_move).reshape(model.shape)
+        return np.array_equal(new_policy, policy), new_policy
+
+'''
+Policy iteration using any of the evaluation modes. In 'modified' mode the values may not have converged when the
+policy stops changing, so it carries on until the Bellman residual is also below accuracy.
+In 'parallel' mode, improvement is split across the same worker processes as evaluation.
+improver: optionally an IncrementalImprover to improve the policy with, which only backs up the (state, action)
+values that the last evaluation could have changed.
+report: optionally a dict, which is filled with the totals over all of the rounds of evaluation and improvement,
+and with an improver, the backups made and skipped in each round.
+'''
+def policy_iteration(model, accuracy=0.001, verbose=False, mode='iterative', k=5, report=None, workers=None,
+                     improver=None):
+    start = time.time()
+    policy = np.zeros(model.shape, dtype=int)
+    values = np.zeros(model.shape)
+    rounds = 0
+    sweeps = 0
+    done = False
+    sweeper = ParallelSweeper(model, workers) if mode == 'parallel' else None
+    try:
+        while not done:
+            evaluation = dict()
+            if sweeper is not None:
+                values = sweeper.evaluate(values, policy, accuracy, report=evaluation)
+            else:
+                values = evaluate(values, policy, model, accuracy, verbose=verbose, mode=mode, k=k, report=evaluation)
+            if improver is not None:
+                policy_stable, policy = improver.improve(policy, values)
+            elif sweeper is not None:
+                policy_stable, policy = sweeper.improve(policy, values)
+            else:
+                policy_stable, policy = improve(policy, values, model)
+            rounds += 1
+            sweeps += evaluation['sweeps']
+            done = policy_stable and (mode != 'modified' or evaluation['residual'] < accuracy)
+    finally:
+        if sweeper is not None:
+            sweeper.close()
+
+    if report is not None:
+        report['mode'] = mode
+        report['rounds'] = rounds
+        report['sweeps'] = sweeps
+        report['time'] = time.time() - start
+        report['residual'] = evaluation['residual']
+        if improver is not None:
+            report['backups'] = [backups for backups, skipped in improver.history[-rounds:]]
+            report['skipped'] = [skipped for backups, skipped in improver.history[-rounds:]]
+    return policy, values
+
+# The commands that ParallelSweeper gives its workers
+_LOAD_POLICY, _SWEEP, _IMPROVE, _STOP = range(4)
+
+'''
+Copies an array into a new block of shared memory. Returns the block and the array backed by it.
+'''
+def _shared_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+    return shm, shared
+
+'''
+The loop run by each of ParallelSweeper's workers, which owns the states lo to hi - 1. Every round, it waits on its
+own go semaphore for the next command, carries it out for its own states, and releases the shared done semaphore.
+specs maps the name of each shared array to the name of its memory block, its shape and its dtype.
+'''
+def _sweep_worker(specs, lo, hi, worker, go, done, max_move, gamma):
+    blocks = []
+    arrays = dict()
+    try:
+        for name, (block, shape, dtype) in specs.items():
+            blocks.append(shared_memory.SharedMemory(name=block))
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=blocks[-1].buf)
+        rewards, transitions, legal = arrays['rewards'], arrays['transitions'], arrays['legal']
+        values, policy, control = arrays['values'], arrays['policy'], arrays['control']
+        differences, changed = arrays['differences'], arrays['changed']
+        states = np.arange(lo, hi)
+
+        while True:
+            go.acquire()
+            command = control[0]
+            if command == _STOP:
+                break
+            if command == _LOAD_POLICY:
+                # The rows of the policy's model for this worker's states, kept until the policy changes
+                a = policy[lo:hi] + max_move
+                r_pi, p_pi = rewards[a, states], transitions[a, states]
+            elif command == _SWEEP:
+                # Back up from the current buffer into the other one
+                current = control[1]
+                v = values[current]
+                new_v = r_pi + gamma * (p_pi @ v)
+                differences[worker] = np.max(np.abs(new_v - v[lo:hi]))
+                values[1 - current, lo:hi] = new_v
+            elif command == _IMPROVE:
+                q = rewards[:, lo:hi] + gamma * (transitions[:, lo:hi] @ values[control[1]])
+                q = np.where(legal[:, lo:hi], q, -np.inf)
+                old = policy[lo:hi] + max_move
+                best = np.argmax(q, axis=0)
+                i = np.arange(hi - lo)
+                best = np.where(q[old, i] >= q[best, i], old, best)
+                changed[worker] = np.any(best != old)
+                policy[lo:hi] = best - max_move
+            done.release()
+    finally:
+        for block in blocks:
+            block.close()
+
+class ParallelSweeper:
+    '''
+    Runs policy evaluation and improvement on a pool of worker processes, each of which owns a contiguous block of
+    states. The model, the values and the policy are all held in shared memory, so nothing is copied between
+    processes after the workers start.
+    Evaluation is synchronous (Jacobi), like 'iterative' mode: there are two value buffers, and on each sweep every
+    worker backs up its own states from one buffer into the other. The sweep ends when every worker has reported
+    back, and the largest change is the largest of each worker's own largest change.
+    workers: the number of processes, by default one per core.
+    timeout: optionally, the most seconds a command may take. While waiting, the workers are checked every second,
+    so one that fails or is killed (e.g. running out of memory) is noticed straight away. If a worker dies or the
+    timeout passes, the sweeper is closed and a RuntimeError is raised.
+    Use it as a context manager, or call close when done, to stop the workers and free the shared memory.
+    '''
+    def __init__(self, model, workers=None, timeout=None):
+        self.model = model
+        self.workers = min(workers or os.cpu_count(), model.n_states)
+        self.timeout = timeout
+        self._blocks = []
+        specs = dict()
+        shared = dict()
+        initial = {'rewards': model.rewards,
+                   'transitions': model.transitions,
+                   'legal': model.legal,
+                   'values': np.zeros((2, model.n_states)),
+                   'policy': np.zeros(model.n_states, dtype=np.int64),
+                   # The current command, and which of the value buffers holds the current values
+                   'control': np.zeros(2, dtype=np.int64),
+                   'differences': np.zeros(self.workers),
+                   'changed': np.zeros(self.workers, dtype=bool)}
+        for name, array in initial.items():
+            block, shared[name] = _shared_array(array)
+            self._blocks.append(block)
+            specs[name] = (block.name, array.shape, array.dtype.str)
+        self._values, self._policy, self._control = shared['values'], shared['policy'], shared['control']
+        self._differences, self._changed = shared['differences'], shared['changed']
+
+        # Each worker waits on its own semaphore, so that a quick worker can't take another worker's command.
+        # Semaphores, unlike a barrier, are left in a usable state if a process dies while waiting on one.
+        self._go = [mp.Semaphore(0) for _ in range(self.workers)]
+        self._done = mp.Semaphore(0)
+        bounds = np.linspace(0, model.n_states, self.workers + 1).astype(int)
+        self._processes = [mp.Process(target=_sweep_worker, daemon=True,
+                                      args=(specs, bounds[w], bounds[w + 1], w, self._go[w], self._done,
+                                            model.max_move, model.gamma))
+                           for w in range(self.workers)]
+        for process in self._processes:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    Give every worker a command and wait until all of them have carried it out
+    '''
+    def _check_open(self):
+        if not self._processes:
+            raise RuntimeError("The sweeper has been closed")
+
+    def _run(self, command):
+        self._control[0] = command
+        for go in self._go:
+            go.release()
+        start = time.time()
+        for _ in range(self.workers):
+            while not self._done.acquire(timeout=1):
+                dead = [w for w, process in enumerate(self._processes) if not process.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError(f"Parallel sweep failed: workers {dead} died")
+                if self.timeout is not None and time.time() - start > self.timeout:
+                    self.close()
+                    raise RuntimeError(f"Parallel sweep failed: the workers didn't finish within {self.timeout}s")
+
+    '''
+    The same as evaluate in 'iterative' mode. The residual in the report is found with one more parallel sweep.
+    '''
+    def evaluate(self, values, policy, accuracy=0.001, iterations=None, report=None):
+        self._check_open()
+        start = time.time()
+        self._policy[:] = policy.ravel()
+        self._run(_LOAD_POLICY)
+        self._control[1] = 0
+        self._values[0] = values.ravel()
+        difference = accuracy
+        i = 0
+        while difference >= accuracy and (iterations == None or i < iterations):
+            self._run(_SWEEP)
+            difference = self._differences.max()
+            self._control[1] = 1 - self._control[1]
+            i += 1
+        v = self._values[self._control[1]].copy()
+
+        if report is not None:
+            self._run(_SWEEP)
+            report['mode'] = 'parallel'
+            report['sweeps'] = i
+            report['time'] = time.time() - start
+            report['residual'] = self._differences.max()
+        return v.reshape(self.model.shape)
+
+    '''
+    The same as improve, with each worker improving the policy of its own states
+    '''
+    def improve(self, policy, values):
+        self._check_open()
+        self._policy[:] = policy.ravel()
+        self._values[self._control[1]] = values.ravel()
+        self._run(_IMPROVE)
+        return not self._changed.any(), self._policy.reshape(self.model.shape).copy()
+
+    '''
+    Stop the workers and free the shared memory. Workers that are still busy (after a timeout, say) are terminated.
+    '''
+    def close(self):
+        if self._processes:
+            try:
+                self._control[0] = _STOP
+                for go in self._go:
+                    go.release()
+                for process in self._processes:
+                    process.join(1)
+                    if process.is_alive():
+                        process.terminate()
+                        process.join()
+            finally:
+                self._processes = []
+                # The arrays are views of the blocks, so drop them before the blocks are unmapped
+                self._values = self._policy = self._control = self._differences = self._changed = None
+                for block in self._blocks:
+                    block.close()
+                    block.unlink()
+
+def print_policy(policy):
+    for loc1 in range(policy.shape[0] - 1, -1, -1):
+        for loc2 in range(policy.shape[1]):
+            print(f'{policy[loc1, loc2]}', end = '\t')
+        print('\n')
+
+def print_value(values):
+    for loc1 in range(values.shape[0] - 1, -1, -1):
+        for loc2 in range(values.shape[1]):
+            print(f'{round(values[loc1, loc2])}', end = '\t')
+        print('\n')
+
+'''
+Solve the problem with each evaluation mode and print the sweeps, wall time and final Bellman residual of each.
+model_args are passed on to CarRentalModel, e.g. max_cars=40 for a scaled-up problem.
+'''
+def compare_modes(modes=('iterative', 'exact', 'modified'), k=5, accuracy=0.001, **model_args):
+    model = CarRentalModel(**model_args)
+    results = dict()
+    for mode in modes:
+        report = dict()
+        results[mode] = policy_iteration(model, accuracy, mode=mode, k=k, report=report)
+        print(f"{mode}: {report['rounds']} rounds, {report['sweeps']} sweeps, {round(report['time'], 4)}s, "
+              f"residual {report['residual']:.2e}")
+    return results
+
+if __name__ == '__main__':
+    t = time.time()
+    model = CarRentalModel()
+    print(f"Model ready in {round(time.time() - t, 4)}s")
+    t = time.time()
+    policy, values = policy_iteration(model, verbose=True)
+    print(f"Policy iteration took {round(time.time() - t, 4)}s")
+    print_value(values)
+    print('\n')
+    print_policy(policy)
+
+    for max_cars in (20, 30, 40):
+        print(f"max_cars = {max_cars}")
+        compare_modes(max_cars=max_cars)
+
+    # Synchronous sweeps split across a process per core give the same results as 'iterative'
+    print("max_cars = 50")
+    compare_modes(('iterative', 'parallel'), max_cars=50)
+
+    # Near the end of modified policy iteration the values barely move between rounds, so most of the
+    # (state, action) values don't need backing up again
+    for tolerance in (1e-3, 1e-2):
+        report = dict()
+        incremental = policy_iteration(model, mode='modified', report=report,
+                                       improver=IncrementalImprover(model, tolerance))
+        print(f"Incremental improvement with tolerance {tolerance}: skipped {sum(report['skipped'])} of "
+              f"{sum(report['backups']) + sum(report['skipped'])} backups, per round {report['skipped']}. "
+              f"Same policy as modified: {np.array_equal(incremental[0], policy_iteration(model, mode='modified')[0])}")
@@ -0,0 +1,242 @@
+import heapq
+import time
+
+import numpy as np
+
+'''
+Compiles an MDP that is described with callbacks, like the gridworld in gridworld_iterative_evaluation.ipynb, into
+arrays. The evaluate function in the notebook calls policy(a, s) and new_state(a, s) for every state and action on
+every sweep; here they are called once per (state, action) when the MDP is compiled, and policy evaluation then only
+touches arrays.
+
+The callbacks are the same as the notebook's: policy(action, state) returns the probability of taking an action in a
+state and new_state(action, state) returns the next state. new_state may also return a list of (probability, state)
+pairs for stochastic transitions.
+'''
+
+class TabularMDP:
+    '''
+    Call compile_mdp rather than building one of these directly.
+    successors and probabilities are (states x actions x K) arrays holding up to K next states of each
+    (state, action) and their probabilities. rewards is a (states x actions x K) array of the reward of each of
+    these transitions, and policy is a (states x actions) array of action probabilities.
+    If the MDP was compiled with dense=True, transitions is also set to an (actions x states x states) array.
+    '''
+    def __init__(self, states, actions, terminal, successors, probabilities, rewards, policy, transitions=None):
+        self.states = states
+        self.actions = actions
+        self.index = {s: i for i, s in enumerate(states)}
+        self.terminal = terminal
+        self.successors = successors
+        self.probabilities = probabilities
+        self.rewards = rewards
+        self.policy = policy
+        self.transitions = transitions
+        self.n_states = len(states)
+        self._predecessors = None
+
+    '''
+    Collapse the actions under the policy: returns the expected reward of each state, and for each state the
+    indices of its possible next states with their weights (the probability of reaching them, times gamma).
+    '''
+    def policy_arrays(self, gamma=1):
+        weights = self.policy[:, :, None] * self.probabilities
+        r_pi = (weights * self.rewards).sum(axis=(1, 2))
+        columns = self.successors.reshape(self.n_states, -1)
+        return r_pi, columns, gamma * weights.reshape(self.n_states, -1)
+
+    '''
+    The states whose backups read each state, for prioritized sweeping
+    '''
+    def predecessors(self):
+        if self._predecessors is None:
+            self._predecessors = [set() for _ in range(self.n_states)]
+            for s, row in enumerate(self.successors.reshape(self.n_states, -1)):
+                for s2 in row:
+                    self._predecessors[s2].add(s)
+            self._predecessors = [sorted(p) for p in self._predecessors]
+        return self._predecessors
+
+    '''
+    Convert an array of values back into a dict mapping states to values, like the notebook's evaluate returns
+    '''
+    def value_dict(self, values):
+        return {s: values[i] for i, s in enumerate(self.states)}
+
+'''
+Calls the callbacks once for every state and action and stores the results in arrays.
+reward: either the reward for every transition, as in the notebook, or a callback reward(action, state, next_state).
+Terminal states have no actions: their value is always 0.
+dense: set to true to also build the full (actions x states x states) transition matrix.
+'''
+def compile_mdp(nonterminal_states, terminal_states, actions, policy, new_state, reward=-1, dense=False):
+    states = list(nonterminal_states) + list(terminal_states)
+    index = {s: i for i, s in enumerate(states)}
+    n_states = len(states)
+    n_actions = len(actions)
+
+    outcomes = [[[] for _ in actions] for _ in states]
+    policy_array = np.zeros((n_states, n_actions))
+    for i, s in enumerate(nonterminal_states):
+        for j, a in enumerate(actions):
+            policy_array[i, j] = policy(a, s)
+            result = new_state(a, s)
+            if not isinstance(result, list):
+                result = [(1, result)]
+            for p, s2 in result:
+                r = reward(a, s, s2) if callable(reward) else reward
+                outcomes[i][j].append((p, index[s2], r))
+
+    # Pad every (state, action) out to the largest number of outcomes with zero probability self-transitions
+    k = max(1, max(len(o) for row in outcomes for o in row))
+    successors = np.repeat(np.arange(n_states), n_actions * k).reshape(n_states, n_actions, k)
+    probabilities = np.zeros((n_states, n_actions, k))
+    rewards = np.zeros((n_states, n_actions, k))
+    for i in range(n_states):
+        for j in range(n_actions):
+            for n, (p, s2, r) in enumerate(outcomes[i][j]):
+                successors[i, j, n] = s2
+                probabilities[i, j, n] = p
+                rewards[i, j, n] = r
+
+    transitions = None
+    if dense:
+        transitions = np.zeros((n_actions, n_states, n_states))
+        for n in range(k):
+            np.add.at(transitions, (np.arange(n_actions)[None, :], np.arange(n_states)[:, None], successors[:, :, n]),
+                      probabilities[:, :, n])
+
+    terminal = np.zeros(n_states, dtype=bool)
+    terminal[len(states) - len(terminal_states):] = True
+    return TabularMDP(states, list(actions), terminal, successors, probabilities, rewards, policy_array, transitions)
+
+'''
+Iterative policy evaluation over a compiled MDP, until the largest change in a sweep is less than accuracy, or the
+number of iterations is reached. There are three update orders:
+'synchronous': every state is backed up from the values of the previous sweep (a sparse or dense matrix product).
+'in_place': states are backed up one at a time in order, each using the latest values, as in the notebook.
+'prioritized': prioritized sweeping. The state with the largest Bellman error is always backed up next, and the errors
+of the states that depend on it are updated. Stops when no error is at least accuracy. iterations then counts backups.
+report: optionally a dict, which is filled with the number of sweeps (or backups) and the wall time.
+Returns an array of values, in the order of mdp.states.
+'''
+def evaluate(mdp, accuracy, iterations=None, order='synchronous', gamma=1, report=None):
+    start = time.time()
+    r_pi, columns, weights = mdp.policy_arrays(gamma)
+    values = np.zeros(mdp.n_states)
+    i = 0
+
+    if order == 'synchronous':
+        if mdp.transitions is not None:
+            p_pi = gamma * np.einsum('sa,ast->st', mdp.policy, mdp.transitions)
+        difference = accuracy
+        while difference >= accuracy and (iterations == None or i < iterations):
+            if mdp.transitions is not None:
+                new_values = r_pi + p_pi @ values
+            else:
+                new_values = r_pi + (weights * values[columns]).sum(axis=1)
+            difference = np.max(np.abs(new_values - values))
+            values = new_values
+            i += 1
+
+    elif order == 'in_place':
+        # Plain Python lists are much faster than numpy for one state at a time
+        value_list = values.tolist()
+        rows = [list(zip(w, c)) for w, c in zip(weights.tolist(), columns.tolist())]
+        r_list = r_pi.tolist()
+        difference = accuracy
+        while difference >= accuracy and (iterations == None or i < iterations):
+            difference = 0
+            for s in range(mdp.n_states):
+                old = value_list[s]
+                value_list[s] = r_list[s] + sum(w * value_list[c] for w, c in rows[s])
+                difference = max(difference, abs(old - value_list[s]))
+            i += 1
+        values = np.array(value_list)
+
+    elif order == 'prioritized':
+        value_list = values.tolist()
+        rows = [list(zip(w, c)) for w, c in zip(weights.tolist(), columns.tolist())]
+        r_list = r_pi.tolist()
+        predecessors = mdp.predecessors()
+
+        def backup(s):
+            return r_list[s] + sum(w * value_list[c] for w, c in rows[s])
+
+        # heapq is a min-heap, so priorities are negated. Entries go stale when a state's error changes,
+        # so the current error of each state is kept alongside and stale entries are skipped.
+        errors = [abs(backup(s) - value_list[s]) for s in range(mdp.n_states)]
+        queue = [(-e, s) for s, e in enumerate(errors) if e >= accuracy]
+        heapq.heapify(queue)
+        while queue and (iterations == None or i < iterations):
+            e, s = heapq.heappop(queue)
+            if -e != errors[s]:
+                continue
+            value_list[s] = backup(s)
+            errors[s] = 0
+            i += 1
+            for p in predecessors[s]:
+                errors[p] = abs(backup(p) - value_list[p])
+                if errors[p] >= accuracy:
+                    heapq.heappush(queue, (-errors[p], p))
+        values = np.array(value_list)
+
+    else:
+        raise ValueError(f"Unknown update order {order}")
+
+    if report is not None:
+        report['order'] = order
+        report['sweeps'] = i
+        report['time'] = time.time() - start
+    return values
+
+'''
+Callbacks for an n x n version of the gridworld of Example 4.1, numbered in the same way as the notebook:
+the nonterminal states are 1 to n * n - 2 and the two terminal corners are both state -1.
+'''
+def make_gridworld(n):
+    LEFT, RIGHT, UP, DOWN = -1, 1, -n, n
+    actions = [LEFT, RIGHT, UP, DOWN]
+    nonterminal_states = list(range(1, n * n - 1))
+    terminal_states = [-1]
+
+    def policy(action, state):
+        return 0.25 # equirandom
+
+    def new_state(action, state):
+        x, y = state % n, state // n
+        if (action == LEFT and x == 0) or (action == RIGHT and x == n - 1) \
+                or (action == UP and y == 0) or (action == DOWN and y == n - 1):
+            return state
+        if state + action in (0, n * n - 1):
+            return -1
+        return state + action
+
+    return nonterminal_states, terminal_states, actions, policy, new_state
+
+if __name__ == '__main__':
+    # The 4x4 gridworld with the extra state 15 from the notebook
+    LEFT, RIGHT, UP, DOWN = -1, 1, -4, 4
+    n4_states, n4_terminal, n4_actions, n4_policy, n4_new_state = make_gridworld(4)
+
+    def new_state(action, state):
+        if state == 15:
+            return new_state(action, 13) # same transitions in state 15 as state 13.
+        if action == DOWN and state == 13:
+            return 15
+        return n4_new_state(action, state)
+
+    mdp = compile_mdp(n4_states + [15], n4_terminal, n4_actions, n4_policy, new_state)
+    values = mdp.value_dict(evaluate(mdp, 0.001, order='in_place'))
+    for s in values:
+        print(s, round(values[s], 1))
+
+    # Undiscounted, the random walk on a large grid takes a very long time to converge, so discount it
+    t = time.time()
+    mdp = compile_mdp(*make_gridworld(100))
+    print(f"100x100 compiled in {round(time.time() - t, 2)}s")
+    for order in ('synchronous', 'in_place', 'prioritized'):
+        report = dict()
+        evaluate(mdp, 0.001, order=order, gamma=0.9, report=report)
+        print(f"100x100 {order}: {report['sweeps']} {'backups' if order == 'prioritized' else 'sweeps'}, "
+              f"{round(report['time'], 2)}s")
@@ -2,6 +2,11 @@ import bresenham as br
 import random
 import time
 import signal
+import numpy as np
+import argparse
+import json
+import os
+from multiprocessing import Pool
 
 '''
 Python implementation of off-policy Monte Carlo control learning 
@@ -13,13 +18,81 @@ by George B. Lawrence
 # A state is a tuple containing a position and velocity: ((x_pos, y_pos), (x_vel, y_vel))
 # Positions and velocities are discrete. 
 
+# The actions are changes in velocity. Within the agent's tables an action is referred to by its index in this list. 
+ACTIONS = [(-1, -1),
+           (-1, 0), 
+           (-1, 1),
+           (0, -1), 
+           (0, 0), 
+           (0, 1), 
+           (1, -1), 
+           (1, 0), 
+           (1, 1)]
+
+# The possible outcomes of a move
+CRASH = 0
+FINISH = 1
+MOVE = 2
+
+# In place of the next state in Agent.successors
+FINISHED = -1
+CRASHED = -2
+
+'''
+Loads a track from an ASCII map file, drawn the same way up as visualise_state prints it: the first line of the file
+is the top row of the track and the first character of each line is the leftmost column. Each character is a cell:
+    # out of bounds    . open track    S start line    F finish line
+Lines shorter than the longest are padded with out-of-bounds cells. A track needs at least one start and one
+finish cell, but no walls, since leaving the grid is a crash.
+Returns the number of columns and rows, and lists of the out-of-bounds, start and finish coordinates.
+'''
+def load_track(path):
+    with open(path) as f:
+        lines = [line.rstrip('\n') for line in f]
+    while lines and not lines[-1].strip():
+        lines.pop()
+    rows, cols = len(lines), max(len(line) for line in lines)
+    cells = np.full((rows, cols), '#')
+    for i, line in enumerate(lines):
+        cells[i, :len(line)] = list(line)
+    unknown = set(np.unique(cells).tolist()) - set('#.SF')
+    if unknown:
+        raise ValueError(f"Track {path} has unknown cells: {''.join(sorted(unknown))}")
+    for cell, name in (('S', 'start'), ('F', 'finish')):
+        if not (cells == cell).any():
+            raise ValueError(f"Track {path} has no {name} line ({cell} cells)")
+
+    # Line i of the file is y = rows - i, and character j of a line is x = j + 1
+    def coords(cell):
+        i, j = np.nonzero(cells == cell)
+        return list(zip((j + 1).tolist(), (rows - i).tolist()))
+    return cols, rows, coords('#'), coords('S'), coords('F')
+
 class Environment:
-    def __init__(self):
-        self.track_rows = 32
-        self.track_cols = 17
-        self.track_bounds = self._generate_track()
-        self.track_finish = self._rect_coords((17, 32), (17, 27))
-        self.track_start = self._rect_coords((4, 1), (9, 1))
+    '''
+    precompute: set to true to work out the outcome of every (position, velocity) pair up front, 
+    so that a step is a single table lookup
+    track: optionally, the path of a track file to load (see load_track) instead of the track from the exercise
+    '''
+    def __init__(self, precompute=True, track=None):
+        if track is None:
+            self.track_rows = 32
+            self.track_cols = 17
+            self.track_bounds = self._generate_track()
+            self.track_finish = self._rect_coords((17, 32), (17, 27))
+            self.track_start = self._rect_coords((4, 1), (9, 1))
+        else:
+            self.track_cols, self.track_rows, self.track_bounds, self.track_start, self.track_finish = \
+                load_track(track)
+        # Boolean grids of the out-of-bounds and finish cells, indexed by [x, y]
+        self.bounds_grid = self._coords_grid(self.track_bounds)
+        self.finish_grid = self._coords_grid(self.track_finish)
+        self.outcomes = self._generate_outcomes() if precompute else None
+        self._renderer = None
+        # Which actions are valid only depends on the velocity, indexed by [x_vel + 4, y_vel, action]
+        self.action_mask = np.array([[[a in self.valid_actions((None, (x_vel, y_vel))) for a in ACTIONS] 
+                                      for y_vel in range(5)] 
+                                      for x_vel in range(-4, 5)])
         
     '''
     This generates a list of all the out-of-bounds coordinates
@@ -39,36 +112,71 @@ class Environment:
     '''
     def valid_actions(self, state):
         _, vel = state
-        actions = [(-1, -1),
-                   (-1, 0), 
-                   (-1, 1),
-                   (0, -1), 
-                   (0, 0), 
-                   (0, 1), 
-                   (1, -1), 
-                   (1, 0), 
-                   (1, 1)]
         return list(filter(lambda a:    a[0] + vel[0] in range(-4, 5)
                                     and a[1] + vel[1] in range(5)
                                     and not(a[1] + vel[1] == 0 and a[0] + vel[0] == 0), 
-                                    actions))
+                                    ACTIONS))
 
     '''
     Given a state and an action, this will output the new state, taking into account
     the track boundaries and finish line. 
+    rng: the random number generator used to pick a start position after a crash
     '''
-    def new_state(self, state, action):
+    def new_state(self, state, action, rng=random):
         pos, vel = state
         newvel = (vel[0] + action[0], vel[1] + action[1])
         newpos = (pos[0] + vel[0], pos[1] + vel[1]) # Using the old velocity is done on purpose here
-        path = br.bresenham(pos, newpos)
-        # Check for intersection between path and bounds
-        if list(set(path) & set(self.track_bounds)) or not (1 <= newpos[0] <= self.track_cols and 1 <= newpos[1] <= self.track_rows):
-            return random.choice(self.track_start), (0, 0)
-        # Check for intersection between path and finish
-        if list(set(path) & set(self.track_finish)):
+        if self.outcomes is not None:
+            outcome = self.outcomes[pos[0], pos[1], vel[0] + 4, vel[1]]
+        else:
+            outcome = self.move_outcome(pos, vel)
+        if outcome == CRASH:
+            return rng.choice(self.track_start), (0, 0)
+        if outcome == FINISH:
             return True
         return newpos, newvel
+
+    '''
+    Works out whether moving from a position with a velocity crashes, crosses the finish line,
+    or just moves the car. A crash is checked for first.
+    '''
+    def move_outcome(self, pos, vel):
+        newpos = (pos[0] + vel[0], pos[1] + vel[1])
+        if not (1 <= newpos[0] <= self.track_cols and 1 <= newpos[1] <= self.track_rows):
+            return CRASH
+        xs, ys = zip(*br.bresenham(pos, newpos))
+        # Check for intersection between path and bounds
+        if self.bounds_grid[xs, ys].any():
+            return CRASH
+        # Check for intersection between path and finish
+        if self.finish_grid[xs, ys].any():
+            return FINISH
+        return MOVE
+    
+    '''
+    Table of the outcome of every (position, velocity) pair, indexed by [x, y, x_vel + 4, y_vel]. 
+    The squares that a move passes through are the same offsets from wherever it starts, so rather than checking 
+    the path of every pair, each velocity's offsets are looked up across the whole track at once by shifting the 
+    grids. The grids are padded with 4 cells (the top speed) of out-of-bounds cells on every side, so a move 
+    that leaves the track, or ends in the unused row and column 0, is a crash like in move_outcome. 
+    '''
+    def _generate_outcomes(self):
+        cols, rows = self.track_cols + 1, self.track_rows + 1
+        pad = 4
+        bounds = np.pad(self.bounds_grid, pad, constant_values=True)
+        bounds[pad, :] = True
+        bounds[:, pad] = True
+        finish = np.pad(self.finish_grid, pad)
+        outcomes = np.empty((cols, rows, 9, 5), dtype=np.int8)
+        for x_vel in range(-4, 5):
+            for y_vel in range(5):
+                crash = np.zeros((cols, rows), dtype=bool)
+                finished = np.zeros((cols, rows), dtype=bool)
+                for dx, dy in br.bresenham_offsets(x_vel, y_vel):
+                    crash |= bounds[pad + dx:pad + dx + cols, pad + dy:pad + dy + rows]
+                    finished |= finish[pad + dx:pad + dx + cols, pad + dy:pad + dy + rows]
+                outcomes[:, :, x_vel + 4, y_vel] = np.where(crash, CRASH, np.where(finished, FINISH, MOVE))
+        return outcomes
     
     '''
     For debugging / viewing purposes: 
@@ -78,13 +186,14 @@ class Environment:
     '''
     def visualise_state(self, state):
         pos, vel = state
-        br.visualise((1, 1), (self.track_cols, self.track_rows), {  '#': self.track_bounds, 
-                                                                    '|': self.track_finish,
-                                                                    '_': self.track_start,
-                                                                    '+': br.bresenham(pos, (pos[0] + vel[0], pos[1] + vel[1])), 
-                                                                    'o': [pos]})
+        # The track never changes, so it is only drawn once
+        if self._renderer is None:
+            self._renderer = br.Renderer((1, 1), (self.track_cols, self.track_rows), {  '#': self.track_bounds, 
+                                                                                        '|': self.track_finish,
+                                                                                        '_': self.track_start})
+        print(self._renderer.render({   '+': br.bresenham(pos, (pos[0] + vel[0], pos[1] + vel[1])), 
+                                        'o': [pos]}), end='')
 
-    
     '''
     Helper function to generate a rectangular set of coordinates for track generation
     Takes two points and outputs a set of coordinates
@@ -93,44 +202,151 @@ class Environment:
         return [(x, y)  for x in (range(min(p1[0], p2[0]), max(p1[0], p2[0]) + 1)) 
                         for y in (range(min(p1[1], p2[1]), max(p1[1], p2[1]) + 1))]
 
+    '''
+    Helper function to turn a list of coordinates into a boolean grid indexed by [x, y]
+    '''
+    def _coords_grid(self, coords):
+        grid = np.zeros((self.track_cols + 1, self.track_rows + 1), dtype=bool)
+        # A track doesn't need any walls, since the edge of the grid is a crash anyway
+        xs, ys = np.array(coords, dtype=int).reshape(-1, 2).T
+        grid[xs, ys] = True
+        return grid
+
 class Agent:
-    def __init__(self, env):
+    '''
+    index: optionally the index of the reachable states of another agent on the same track (see encode), to skip 
+    searching for them again
+    tables: set to false for an agent that only generates trajectories with the random behaviour policy, such as 
+    the workers of learn_parallel, so that no tables are allocated for it
+    '''
+    def __init__(self, env, index=None, tables=True):
         self.env = env
-        self._generate_tables()
+        self._generate_tables(index, tables)
+
+    '''
+    States are encoded as a single integer. Every (position, velocity) pair has a slot 
+    ((x * (rows + 1) + y) * 9 + x_vel + 4) * 5 + y_vel, but only the states that the car can reach are numbered: 
+    index maps each slot to its number (or -1), and states maps each number back to its slot. 
+    '''
+    def encode(self, state):
+        (x, y), (x_vel, y_vel) = state
+        return self.index[((x * (self.env.track_rows + 1) + y) * 9 + x_vel + 4) * 5 + y_vel]
+
+    def decode(self, s):
+        s, y_vel = divmod(int(self.states[s]), 5)
+        s, x_vel = divmod(s, 9)
+        x, y = divmod(s, self.env.track_rows + 1)
+        return (x, y), (x_vel - 4, y_vel)
+
+    '''
+    Marks every slot of a state that the car can reach from the start line. This is a breadth-first search, 
+    stepping every state at the same distance from the start line at once. A move only leads to a new state, 
+    since a crash goes back to the start line and crossing the finish line ends the episode. 
+    '''
+    def _reachable(self):
+        env = self.env
+        outcomes = env.outcomes if env.outcomes is not None else env._generate_outcomes()
+        rows = env.track_rows + 1
+        # The outcome table is laid out in the same order as the slots, so it can be indexed by slot
+        outcomes = outcomes.reshape(-1)
+        mask = env.action_mask.reshape(45, 9)
+        actions = np.array(ACTIONS, dtype=np.int32)
+        velocities = np.arange(45, dtype=np.int32)
+        # For each velocity, how far a move shifts the position, and the new velocity after each action
+        shifts = (velocities // 5 - 4) * rows + velocities % 5
+        new_velocities = (velocities[:, None] // 5 + actions[:, 0]) * 5 + velocities[:, None] % 5 + actions[:, 1]
+        reachable = np.zeros(outcomes.size, dtype=bool)
+        # Scratch space for removing repeats from the frontier
+        last = np.empty(outcomes.size, dtype=np.int32)
+        xs, ys = np.array(env.track_start, dtype=np.int32).T
+        frontier = (xs * rows + ys) * 45 + 4 * 5 # Standing still on the start line
+        reachable[frontier] = True
+        while len(frontier):
+            frontier = frontier[outcomes[frontier] == MOVE]
+            position, velocity = np.divmod(frontier, 45)
+            # Every valid action from a state leads to the same position, with its own new velocity
+            new = ((position + shifts[velocity]) * 45)[:, None] + new_velocities[velocity]
+            new = new[mask[velocity]]
+            new = new[~reachable[new]]
+            # Each slot records where it last appears, and only that appearance is kept
+            last[new] = np.arange(len(new), dtype=np.int32)
+            frontier = new[last[new] == np.arange(len(new))]
+            reachable[frontier] = True
+        return reachable
 
     '''
     Generate the tables required for MC prediction including the values and the target policy. 
+    On a large track most of the reachable states are never visited, so q and c only get a row for a state once 
+    it's backed up: rows maps each state to its row of q and c (or -1), and q and c are (rows x actions) arrays 
+    which grow by blocks of rows as they're needed. q is float32, but c is float64 since the importance sampling 
+    weights it sums grow exponentially with the length of an episode. A new row has a value of -1000 for the valid actions 
+    and -inf for the invalid ones, so that they are never chosen by the greedy policy. The policy holds the index 
+    of the greedy action of every reachable state, which is the first valid action until the state is visited. 
     '''
-    def _generate_tables(self):
-        positions = [(x, y) for x in range(1, self.env.track_cols + 1) 
-                            for y in range(1, self.env.track_rows + 1) 
-                            if (x, y) not in self.env.track_bounds]
-        states = [(pos, (x_vel, y_vel)) for pos in positions for x_vel in range(-4, 5) for y_vel in range(5)]
-        entries = [(state, action) for state in states for action in self.env.valid_actions(state)]
-        self.q = {s_a : -1000 for s_a in entries} # Value table
-        self.c = {s_a : 0 for s_a in entries}
-        self.policy = {s : self.env.valid_actions(s)[0] for s in states}
+    def _generate_tables(self, index=None, tables=True):
+        if index is None:
+            reachable = self._reachable()
+            self.states = np.flatnonzero(reachable).astype(np.int32)
+            self.index = np.full(reachable.size, -1, dtype=np.int32)
+            self.index[self.states] = np.arange(len(self.states), dtype=np.int32)
+        else:
+            self.index = index
+            self.states = np.flatnonzero(index >= 0).astype(np.int32)
+        mask = self.env.action_mask.reshape(45, 9)
+        # The indices of the valid actions for each velocity, for the random behaviour policy
+        self._valid_by_velocity = [list(np.flatnonzero(m)) for m in mask]
+        if not tables:
+            return
+        # A new row of q and the number of valid actions only depend on the velocity
+        self._initial_q = np.where(mask, -1000, -np.inf).astype(np.float32)
+        self._n_valid = mask.sum(axis=1).astype(float).tolist()
+        self.rows = np.full(len(self.states), -1, dtype=np.int32)
+        self.n_rows = 0
+        self.q = np.empty((0, len(ACTIONS)), dtype=np.float32) # Value table
+        self.c = np.empty((0, len(ACTIONS)))
+        self.policy = np.argmax(self._initial_q, axis=1).astype(np.int8)[self.states % 45]
 
     '''
-    Runs a single episode in the environment, and returns the sequence of states and actions encountered.
+    The row of q and c of a state, allocating it if the state doesn't have one yet. When q and c are full, 
+    they're doubled in size (by at least block_size rows), so growing them takes amortised constant time. 
+    '''
+    def _row(self, s, block_size=4096):
+        row = self.rows[s]
+        if row >= 0:
+            return row
+        row = self.rows[s] = self.n_rows
+        if row == len(self.q):
+            grow = max(block_size, len(self.q))
+            self.q = np.concatenate((self.q, np.empty((grow, len(ACTIONS)), dtype=np.float32)))
+            self.c = np.concatenate((self.c, np.empty((grow, len(ACTIONS)))))
+        self.q[row] = self._initial_q[self.states[s] % 45]
+        self.c[row] = 0
+        self.n_rows += 1
+        return row
+
+    '''
+    Runs a single episode in the environment, and returns the sequence of states and actions encountered,
+    as (encoded state, action index) pairs. 
     visualise: Set to true if you want the run to be visualised in stdout. 
     delay: Set a delay, in seconds, between each step for visualisation purposes
     deterministic: Set to false to use a random policy, and true to use a deterministic learned policy
     max_steps: Force the episode to end after a certain number of steps. Only use with deterministic 
+    rng: the random number generator to use (by default the random module's)
     '''
-    def generate_trajectory(self, visualise = False, delay = 0, deterministic = False, max_steps = 0):
+    def generate_trajectory(self, visualise = False, delay = 0, deterministic = False, max_steps = 0, rng = random):
         sequence = []
-        state = (random.choice(self.env.track_start), (0, 0))
+        state = (rng.choice(self.env.track_start), (0, 0))
         steps = 0
         while True:
             if visualise:
                 self.env.visualise_state(state)
+            s = self.encode(state)
             if deterministic:
-                action = self.policy[state]
+                a = self.policy[s]
             else:
-                action = random.choice(self.env.valid_actions(state))
-            sequence.append((state, action))
-            new_state = self.env.new_state(state, action)
+                a = rng.choice(self._valid_by_velocity[(state[1][0] + 4) * 5 + state[1][1]])
+            sequence.append((s, a))
+            new_state = self.env.new_state(state, ACTIONS[a], rng)
             if new_state == True or (max_steps > 0 and steps > max_steps):
                 return sequence
             state = new_state
@@ -139,53 +355,296 @@ class Agent:
             if delay > 0:
                 time.sleep(delay)
 
+    '''
+    The state that every state leads to when taking actions, an array of one action index for each state (or a
+    single action index for all of them). Since only a crash is random, the result is an array of the row of the
+    next state, or FINISHED if the move crosses the finish line, or CRASHED if it crashes.
+    '''
+    def successors(self, actions):
+        env = self.env
+        outcomes = env.outcomes if env.outcomes is not None else env._generate_outcomes()
+        rows = env.track_rows + 1
+        position, velocity = np.divmod(self.states, 45)
+        x, y = np.divmod(position, rows)
+        x_vel, y_vel = velocity // 5 - 4, velocity % 5
+        outcome = outcomes[x, y, velocity // 5, y_vel]
+        dx, dy = np.array(ACTIONS)[actions].T
+        new = (position + x_vel * rows + y_vel) * 45 + (x_vel + dx + 4) * 5 + y_vel + dy
+        new = self.index[np.where(outcome == MOVE, new, 0)]
+        return np.where(outcome == MOVE, new, np.where(outcome == FINISH, FINISHED, CRASHED)).astype(np.int32)
+
     '''
     Learn using off-policy Monte Carlo prediction. Behaviour policy is random.
+    Returns the same report as learn_parallel.
     '''
     def learn(self, episodes):
+        start = time.time()
+        backups = 0
         for _ in range(episodes):
-            traj = self.generate_trajectory()
-            w = 1
-            g = 0
-            for t in range(len(traj) - 1, -1, -1):
-                g -= 1
-                state, action = traj[t]
-                self.c[(state, action)] += w
-                self.q[(state, action)] += (w / self.c[(state, action)]) * (g - self.q[(state, action)])
-                best_v = None
-                best_a = self.policy[state]
-                for a in self.env.valid_actions(state):
-                    v = self.q[(state, a)]
-                    if best_v == None or v > best_v:
-                        best_v = v
-                        best_a = a
-                self.policy[state] = best_a
-                if action != self.policy[state]:
-                    break
-                w = w / (1 / len(self.env.valid_actions(state)))
-
-env = Environment()
-state = (random.choice(env.track_start), (0, 0))
-agent = Agent(env)
-
-'''
-Show us a deterministic run on ctrl-c
-'''
-def onquit(s, f):
-    agent.generate_trajectory(visualise=True, delay=0.1, deterministic=True, max_steps=100)
-signal.signal(signal.SIGINT, onquit)
-
-episodes = 0
+            backups += self.backup(self.generate_trajectory())
+        return _learning_report(episodes, backups, time.time() - start)
+
+    '''
+    The weighted importance sampling backups for a single trajectory, working backwards from the end
+    '''
+    def backup(self, traj):
+        policy = self.policy
+        w = 1
+        g = 0
+        for t in range(len(traj) - 1, -1, -1):
+            g -= 1
+            s, a = traj[t]
+            row = self._row(s)
+            q, c = self.q[row], self.c[row]
+            c[a] += w
+            q[a] += (w / c[a]) * (g - q[a])
+            policy[s] = np.argmax(q)
+            if a != policy[s]:
+                break
+            w = w * self._n_valid[self.states[s] % 45]
+        # The number of backups made
+        return len(traj) - t
+
+    '''
+    Learn using off-policy Monte Carlo prediction, with the trajectories generated in a pool of worker processes. 
+    This works because the behaviour policy is random, so the trajectories don't depend on what has been learned. 
+    The episodes are split into batches, and each batch gets its own random number generator seeded from seed, so 
+    the result is the same for any number of workers. The backups are applied in order in this process.
+    Returns a report of the number of episodes and backups, the time taken and the throughput. 
+    '''
+    def learn_parallel(self, episodes, workers=None, batch_size=100, seed=None):
+        start = time.time()
+        batches = [min(batch_size, episodes - i) for i in range(0, episodes, batch_size)]
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(batches))]
+        backups = 0
+        with Pool(workers, initializer=_init_worker, initargs=(self.env, self.index)) as pool:
+            for trajectories in pool.imap(_generate_batch, zip(seeds, batches)):
+                for traj in trajectories:
+                    backups += self.backup(traj)
+        return _learning_report(episodes, backups, time.time() - start)
+
+    '''
+    Save the tables to a checkpoint directory, as one .npy file per table so that they can be memory-mapped back in. 
+    Only the allocated rows of q and c are saved. 
+    Each file is written under a temporary name first, so an interrupted save never leaves a half-written checkpoint. 
+    '''
+    def save(self, path, episodes=0):
+        os.makedirs(path, exist_ok=True)
+        tables = {'q': self.q[:self.n_rows], 'c': self.c[:self.n_rows], 'rows': self.rows, 'policy': self.policy}
+        for name, table in tables.items():
+            np.save(os.path.join(path, f'{name}.tmp.npy'), table)
+            os.replace(os.path.join(path, f'{name}.tmp.npy'), os.path.join(path, f'{name}.npy'))
+        meta = {'episodes': episodes, 'track_cols': self.env.track_cols, 'track_rows': self.env.track_rows,
+                'states': len(self.states)}
+        with open(os.path.join(path, 'meta.tmp.json'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta.tmp.json'), os.path.join(path, 'meta.json'))
+
+    '''
+    Load the tables from a checkpoint directory and return the number of episodes trained so far. 
+    mmap_mode is passed on to np.load: the default 'c' (copy-on-write) only reads pages as they are used 
+    and never writes back, so training can resume from it (although q and c are read in as soon as they grow). 
+    Use 'r' to only evaluate, or None to read everything in. 
+    '''
+    def load(self, path, mmap_mode='c'):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if (meta['track_cols'], meta['track_rows'], meta.get('states')) != \
+                (self.env.track_cols, self.env.track_rows, len(self.states)):
+            raise ValueError(f"Checkpoint {path} is for a different track")
+        if not os.path.exists(os.path.join(path, 'rows.npy')):
+            raise ValueError(f"Checkpoint {path} was saved with a row for every state, which is no longer supported")
+        for name in ('q', 'c', 'rows', 'policy'):
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+        self.n_rows = len(self.q)
+        return meta['episodes']
+
+def _learning_report(episodes, backups, duration):
+    return {'episodes': episodes, 
+            'backups': backups, 
+            'time': duration, 
+            'episodes_per_sec': episodes / duration if duration > 0 else 0, 
+            'backups_per_sec': backups / duration if duration > 0 else 0}
+
+'''
+Headless training: no visualisation, and progress (with the episodes and backups per second of the last chunk) 
+is only printed when a checkpoint is saved. 
+episodes: the number of episodes to train for (on top of any already trained)
+checkpoint: the directory to save checkpoints to, or None to not save any
+checkpoint_every: the number of episodes between checkpoints
+workers: the number of processes to generate trajectories in. Leave as None to learn in this process only.
+seed: each chunk of episodes is seeded with seed plus the number of episodes trained before it, so a resumed run 
+carries on with new episodes rather than repeating the ones it has already learned from. 
+Ctrl-c saves a checkpoint and stops. 
+Returns the total number of episodes trained. 
+'''
+def train(agent, episodes, checkpoint=None, checkpoint_every=10000, workers=None, seed=None, trained=0):
+    target = trained + episodes
+    start = time.time()
+    try:
+        while trained < target:
+            chunk = min(checkpoint_every, target - trained)
+            if workers is None:
+                if seed is not None:
+                    random.seed(seed + trained)
+                report = agent.learn(chunk)
+            else:
+                report = agent.learn_parallel(chunk, workers=workers, seed=None if seed is None else seed + trained)
+            trained += chunk
+            if checkpoint is not None:
+                agent.save(checkpoint, trained)
+            print(f"{trained} episodes trained, {round(time.time() - start, 1)}s "
+                  f"({round(report['episodes_per_sec'])} episodes/sec, {round(report['backups_per_sec'])} backups/sec)")
+    except KeyboardInterrupt:
+        # The episodes of the interrupted chunk aren't counted, although some of them may have been learned
+        if checkpoint is not None:
+            agent.save(checkpoint, trained)
+        print(f"Stopped after {trained} episodes")
+    return trained
+
+'''
+Each worker process keeps its own agent, only used to generate random behaviour policy trajectories. It's given the 
+index of the reachable states, so it neither searches for them again nor allocates any tables.
+'''
+_worker_agent = None
+
+def _init_worker(env, index):
+    global _worker_agent
+    _worker_agent = Agent(env, index=index, tables=False)
 
 '''
+Generate a batch of trajectories with its own random number generator. The trajectories are sent back as 
+one array of (state, action) rows, which is much quicker to pass between processes than lists of tuples, 
+and then split up into a (length x 2) array per trajectory. 
+'''
+def _generate_batch(args):
+    seed, episodes = args
+    rng = random.Random(seed)
+    trajectories = [_worker_agent.generate_trajectory(rng=rng) for _ in range(episodes)]
+    lengths = [len(traj) for traj in trajectories]
+    rows = np.array([step for traj in trajectories for step in traj], dtype=np.int32)
+    return np.split(rows, np.cumsum(lengths)[:-1])
+
+'''
+Show deterministic runs of the learned policy, one after another, forever. 
 Note: For visualisation, you probably want your command line window quite large. 
 For best viewing it should be 32 lines tall (or if you've changed the track, 
 however tall you made it.)
 '''
+def visualise(agent, delay=0.1, max_steps=100):
+    while True:
+        agent.generate_trajectory(visualise=True, delay=delay, deterministic=True, max_steps=max_steps)
+
+'''
+Evaluates the learned policy without rendering anything: the greedy policy is run from every cell of the start line,
+plus restarts noisy runs from each cell, in which the velocity increments are both zero with probability noise
+(as in the exercise's harder variant). All of the runs are stepped together as arrays, using the tables of where
+each state leads, so a step of every run is a few lookups.
+max_steps: a run that hasn't finished after this many steps is stopped and counted as capped
+seed: seeds the choice of start cell after a crash, and the noise
+Returns a dict of arrays with an entry for each run: its start cell, whether it was noisy, the steps it took
+(max_steps for capped runs), its number of crashes and whether it finished. Also the share of the runs that were
+capped, and the mean steps and crashes of the greedy runs.
+'''
+def evaluate_policy(agent, max_steps=1000, restarts=0, noise=0.1, seed=None):
+    env = agent.env
+    rng = np.random.default_rng(seed)
+    rows = env.track_rows + 1
+    start = np.array(env.track_start, dtype=np.int32)
+    start_rows = agent.index[(start[:, 0] * rows + start[:, 1]) * 45 + 4 * 5]
+    greedy = agent.successors(np.asarray(agent.policy))
+    still = agent.successors(ACTIONS.index((0, 0)))
+
+    cells = np.tile(np.arange(len(start)), 1 + restarts)
+    noisy = np.arange(len(cells)) >= len(start)
+    state = start_rows[cells]
+    steps = np.full(len(cells), max_steps)
+    crashes = np.zeros(len(cells), dtype=int)
+    finished = np.zeros(len(cells), dtype=bool)
+    # The runs that are still going
+    running = np.arange(len(cells))
+    for t in range(max_steps):
+        if not len(running):
+            break
+        new = greedy[state]
+        if restarts > 0:
+            slip = noisy[running] & (rng.random(len(running)) < noise)
+            new[slip] = still[state[slip]]
+        crashed = new == CRASHED
+        crashes[running[crashed]] += 1
+        new[crashed] = start_rows[rng.integers(len(start), size=np.count_nonzero(crashed))]
+        done = new == FINISHED
+        steps[running[done]] = t + 1
+        finished[running[done]] = True
+        running, state = running[~done], new[~done]
+
+    return {'start': start[cells],
+            'noisy': noisy,
+            'steps': steps,
+            'crashes': crashes,
+            'finished': finished,
+            'capped_share': 1 - finished.mean(),
+            'mean_steps': steps[~noisy].mean(),
+            'mean_crashes': crashes[~noisy].mean()}
+
+'''
+The original interactive loop: a visualised deterministic run between every 100 episodes of training,
+and a deterministic run on ctrl-c
+'''
+def interactive(agent):
+    def onquit(s, f):
+        agent.generate_trajectory(visualise=True, delay=0.1, deterministic=True, max_steps=100)
+    signal.signal(signal.SIGINT, onquit)
+
+    episodes = 0
+    while True:
+        agent.generate_trajectory(visualise=True, delay=0.1, deterministic=True, max_steps=100) 
+        print(f"{episodes } episodes trained")
+        agent.learn(100)
+        episodes += 100
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Off-policy Monte Carlo control for the racetrack (Exercise 5.12)")
+    parser.add_argument('--track', default=None, help="a track file to race on instead of the exercise's track")
+    commands = parser.add_subparsers(dest='command', required=True)
+    train_parser = commands.add_parser('train', help="train headless, saving checkpoints")
+    train_parser.add_argument('--episodes', type=int, default=100000)
+    train_parser.add_argument('--checkpoint', default='racecar_checkpoint', help="checkpoint directory")
+    train_parser.add_argument('--checkpoint-every', type=int, default=10000)
+    train_parser.add_argument('--resume', action='store_true', help="continue from the checkpoint")
+    train_parser.add_argument('--workers', type=int, default=None, help="generate trajectories in this many processes")
+    train_parser.add_argument('--seed', type=int, default=None)
+    visualise_parser = commands.add_parser('visualise', help="show deterministic runs of a checkpoint's policy")
+    visualise_parser.add_argument('--checkpoint', default='racecar_checkpoint')
+    visualise_parser.add_argument('--delay', type=float, default=0.1)
+    visualise_parser.add_argument('--max-steps', type=int, default=100)
+    evaluate_parser = commands.add_parser('evaluate', help="run a checkpoint's policy from every start cell")
+    evaluate_parser.add_argument('--checkpoint', default='racecar_checkpoint')
+    evaluate_parser.add_argument('--max-steps', type=int, default=1000)
+    evaluate_parser.add_argument('--restarts', type=int, default=0, help="noisy runs from each start cell")
+    evaluate_parser.add_argument('--noise', type=float, default=0.1)
+    evaluate_parser.add_argument('--seed', type=int, default=None)
+    commands.add_parser('interactive', help="the original loop, alternating training with visualised runs")
+    args = parser.parse_args()
 
-while True:
-    # Demonstrate a deterministic run - comment this out if you just want it to train as fast as possible
-    traj = agent.generate_trajectory(visualise=True, delay=0.1, deterministic=True, max_steps=100) 
-    print(f"{episodes } episodes trained")
-    agent.learn(100)
-    episodes += 100
\ No newline at end of file
+    env = Environment(track=args.track)
+    agent = Agent(env)
+    if args.command == 'train':
+        trained = 0
+        if args.resume:
+            trained = agent.load(args.checkpoint)
+        train(agent, args.episodes, args.checkpoint, args.checkpoint_every, args.workers, args.seed, trained)
+    elif args.command == 'visualise':
+        agent.load(args.checkpoint, mmap_mode='r')
+        visualise(agent, args.delay, args.max_steps)
+    elif args.command == 'evaluate':
+        agent.load(args.checkpoint, mmap_mode='r')
+        report = evaluate_policy(agent, args.max_steps, args.restarts, args.noise, args.seed)
+        greedy = ~report['noisy']
+        for (x, y), steps, crashes, finished in zip(report['start'][greedy], report['steps'][greedy],
+                                                    report['crashes'][greedy], report['finished'][greedy]):
+            print(f"Start ({x}, {y}): {steps} steps, {crashes} crashes{'' if finished else ' (capped)'}")
+        print(f"Greedy runs: {report['mean_steps']:.1f} steps and {report['mean_crashes']:.2f} crashes on average. "
+              f"{report['capped_share']:.1%} of all runs capped")
+    else:
+        interactive(agent)
@@ -1,44 +1,118 @@
+from functools import lru_cache
+
+import numpy as np
+
 '''
-While trying to work out how to calculate which squares the car passes through 
+While trying to work out how to calculate which squares the car passes through
 between two time steps, I came across Bresenham's algorithm for rasterizing lines
-and decided to implement it myself as an interesting side task. 
-The function takes the start and end coordinates of the line and outputs a list 
-of coordinates of the squares that the line passes through. 
+and decided to implement it myself as an interesting side task.
+The function takes the start and end coordinates of the line and outputs a list
+of coordinates of the squares that the line passes through.
+The squares only depend on where the line starts relative to its end, so the rasterized
+offsets are cached by displacement and just shifted to the start of the line.
 '''
 def bresenham(start, end):
+    offsets = bresenham_offsets(end[0] - start[0], end[1] - start[1])
+    return [(start[0] + x, start[1] + y) for x, y in offsets]
+
+'''
+The squares that a line from (0, 0) to (dx, dy) passes through, as a tuple.
+Only the most recently used displacements are kept, so the cache can't grow without bound.
+'''
+@lru_cache(maxsize=4096)
+def bresenham_offsets(dx, dy):
+    start, end = (0, 0), (dx, dy)
     # horizontal case
     if start[1] == end[1]:
-        return [(x, start[1]) for x in range(min(start[0], end[0]), max(start[0], end[0]) + 1)]
+        return tuple((x, start[1]) for x in range(min(start[0], end[0]), max(start[0], end[0]) + 1))
     # vertical case
     if start[0] == end[0]:
-        return [(start[0], y) for y in range(min(start[1], end[1]), max(start[1], end[1]) + 1)]
+        return tuple((start[0], y) for y in range(min(start[1], end[1]), max(start[1], end[1]) + 1))
     slope = (start[1] - end[1]) / (start[0] - end[0])
     if abs(slope) <= 1:
         if start[0] <= end[0]:
             p1, p2 = start, end
         else:
             p1, p2 = end, start
-        return [(p1[0] + x, p1[1] + round(x * slope)) for x in range(0, p2[0] - p1[0] + 1)]
+        return tuple((p1[0] + x, p1[1] + round(x * slope)) for x in range(0, p2[0] - p1[0] + 1))
     else:
         if start[1] <= end[1]:
             p1, p2 = start, end
         else:
             p1, p2 = end, start
-        return [(p1[0] + round(y * (1 / slope)), p1[1] + y) for y in range(0, p2[1] - p1[1] + 1)]
+        return tuple((p1[0] + round(y * (1 / slope)), p1[1] + y) for y in range(0, p2[1] - p1[1] + 1))
+
+'''
+Rasterizes many lines at once. starts and ends are (n x 2) arrays of coordinates.
+Returns three arrays with one entry per square: the x and y coordinates, and the index of the line that the
+square belongs to. The squares of each line are in the same order as bresenham returns them.
+'''
+def bresenham_batch(starts, ends):
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    dx, dy = (ends - starts).T
+    # Lines are stepped along x unless they're steeper than 45 degrees
+    steep = np.abs(dy) > np.abs(dx)
+    lengths = np.where(steep, np.abs(dy), np.abs(dx)) + 1
 
-''' 
-Simple function to visualise sets of coordinates in a grid with any character. 
-The data arg is a dict. The key is the character and the value is the set of 
+    # Start each line from its lower end along the axis it's stepped along, like bresenham does
+    flip = np.where(steep, dy < 0, dx < 0)
+    p1 = np.where(flip[:, None], ends, starts)
+    # Horizontal and vertical lines don't move along their minor axis at all
+    slope = np.divide(dy, dx, out=np.zeros(len(dx)), where=dx != 0)
+    inverse = np.divide(1, slope, out=np.zeros(len(dx)), where=slope != 0)
+
+    lines = np.repeat(np.arange(len(starts)), lengths)
+    steps = np.arange(lines.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    major = np.where(steep[lines], p1[lines, 1], p1[lines, 0]) + steps
+    minor = np.where(steep[lines], p1[lines, 0] + np.round(steps * inverse[lines]),
+                                   p1[lines, 1] + np.round(steps * slope[lines])).astype(np.int64)
+    xs = np.where(steep[lines], minor, major)
+    ys = np.where(steep[lines], major, minor)
+    return xs, ys, lines
+
+'''
+Simple function to visualise sets of coordinates in a grid with any character.
+The data arg is a dict. The key is the character and the value is the set of
 coordinates to be represented by that character.
-If a coordinate appears in multiple sets of coordinates, the character used 
-will be the last one for which the coordinate appears. 
+If a coordinate appears in multiple sets of coordinates, the character used
+will be the last one for which the coordinate appears.
 '''
 def visualise(bottomleft, topright, data):
-    for y in range(topright[1], bottomleft[1] - 1, -1):
-        for x in range(bottomleft[0], topright[0] + 1): 
-            char = ' '
-            for c in data.keys():
-                if (x, y) in data[c]:
-                    char = c
-            print(char, end=' ')
-        print()
\ No newline at end of file
+    print(Renderer(bottomleft, topright).render(data), end='')
+
+'''
+Builds whole frames as a single string. The background is drawn into a character grid once,
+and each frame only copies the grid and stamps the data for that frame on top of it.
+'''
+class Renderer:
+    def __init__(self, bottomleft, topright, background=None):
+        self.bottomleft = bottomleft
+        self.topright = topright
+        self.grid = np.full((topright[1] - bottomleft[1] + 1, topright[0] - bottomleft[0] + 1), ' ')
+        if background is not None:
+            self._stamp(self.grid, background)
+
+    '''
+    Draw each set of coordinates onto the grid in order, skipping any that fall outside of it.
+    Rows are stored top first, so that the grid reads the same way that it's printed.
+    '''
+    def _stamp(self, grid, data):
+        for char, coords in data.items():
+            if len(coords) == 0:
+                continue
+            # Any iterable of coordinates works, including a set
+            xs, ys = np.asarray(list(coords)).reshape(-1, 2).T
+            inside = (self.bottomleft[0] <= xs) & (xs <= self.topright[0]) & \
+                     (self.bottomleft[1] <= ys) & (ys <= self.topright[1])
+            grid[self.topright[1] - ys[inside], xs[inside] - self.bottomleft[0]] = char
+
+    '''
+    Returns the frame, with the data drawn over the background, as a string in the same layout as visualise prints
+    '''
+    def render(self, data=None):
+        grid = self.grid
+        if data is not None:
+            grid = grid.copy()
+            self._stamp(grid, data)
+        return ''.join(' '.join(row) + ' \n' for row in grid)
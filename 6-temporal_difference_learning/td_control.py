@@ -0,0 +1,199 @@
+import random
+import time
+from array import array
+
+import numpy as np
+
+'''
+A reusable engine for tabular TD control: Sarsa, Expected Sarsa and Q-learning (chapter 6 of Reinforcement Learning -
+An Introduction, Sutton & Barto), and n-step Sarsa and n-step Expected Sarsa (chapter 7).
+States and actions are integers. The environment is given as a transition table, so a step is a lookup rather than
+a method call, and the value table is a flat array indexed by state * actions + action.
+'''
+
+class TransitionTable:
+    '''
+    next_states and rewards are (states x actions x outcomes) arrays. Each step, one of the outcomes is picked with
+    equal probability, so a deterministic environment has a single outcome. Episodes run from start to terminal.
+    '''
+    def __init__(self, next_states, rewards, start, terminal):
+        self.n_states, self.n_actions, self.n_outcomes = next_states.shape
+        self.start = start
+        self.terminal = terminal
+        # Flat lists are much quicker than numpy arrays to index one element at a time
+        self.next_states = next_states.ravel().tolist()
+        self.rewards = rewards.ravel().tolist()
+
+'''
+Build the transition table of a windy gridworld Environment from windy_gridworld.py.
+States are indexed by (x - 1) * height + (y - 1). With stochastic wind (ex 10) there are three equally likely
+outcomes: the wind is one weaker, the same or one stronger in windy columns. Otherwise there is one outcome.
+'''
+def windy_table(env):
+    width, height = env.world_width, env.world_height
+    stochastic = env.ex == 10
+    variations = (-1, 0, 1) if stochastic else (0,)
+    next_states = np.zeros((width * height, len(env.actions), len(variations)), dtype=np.int64)
+    rewards = np.zeros(next_states.shape)
+    for x in range(1, width + 1):
+        for y in range(1, height + 1):
+            for a, (dx, dy) in enumerate(env.actions):
+                for k, variation in enumerate(variations):
+                    xpos, ypos = x + dx, y + dy
+                    wind = env.wind[xpos]
+                    if wind:
+                        ypos += wind + variation
+                    xpos = min(max(xpos, 1), width)
+                    ypos = min(max(ypos, 1), height)
+                    next_states[(x - 1) * height + y - 1, a, k] = (xpos - 1) * height + ypos - 1
+                    rewards[(x - 1) * height + y - 1, a, k] = 0 if (xpos, ypos) == env.goal_state else -1
+    start = (env.start_state[0] - 1) * height + env.start_state[1] - 1
+    terminal = (env.goal_state[0] - 1) * height + env.goal_state[1] - 1
+    return TransitionTable(next_states, rewards, start, terminal)
+
+class TDControl:
+    '''
+    algorithm: 'sarsa', 'expected_sarsa' or 'q_learning'
+    n: the number of steps before bootstrapping. Q-learning is one-step only, since n-step Q-learning would need
+    importance sampling.
+    The behaviour policy is epsilon-greedy, with ties between greedy actions broken randomly.
+    '''
+    def __init__(self, table, algorithm='sarsa', n=1, alpha=0.5, epsilon=0.1, gamma=1, initial=-50, seed=None):
+        if algorithm not in ('sarsa', 'expected_sarsa', 'q_learning'):
+            raise ValueError(f"Unknown algorithm {algorithm}")
+        if algorithm == 'q_learning' and n != 1:
+            raise ValueError("Q-learning is one-step only")
+        self.table = table
+        self.algorithm = algorithm
+        self.n = n
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.gamma = gamma
+        self.rng = random.Random(seed)
+        self.q = array('d', [initial]) * (table.n_states * table.n_actions)
+        # The terminal state is worth 0
+        for a in range(table.n_actions):
+            self.q[table.terminal * table.n_actions + a] = 0
+
+    '''
+    The value table as a (states x actions) numpy array. This shares memory with the engine's table.
+    '''
+    def q_table(self):
+        return np.frombuffer(self.q, dtype=np.float64).reshape(self.table.n_states, self.table.n_actions)
+
+    '''
+    Choose the greedy action with probability 1 - epsilon, a random action otherwise.
+    A single pass over the actions: each new tie replaces the current choice with probability 1 / (number of ties
+    so far), which leaves every tied action equally likely to be chosen.
+    '''
+    def select(self, s):
+        rng = self.rng
+        n_actions = self.table.n_actions
+        if rng.random() < self.epsilon:
+            return rng.randrange(n_actions)
+        q = self.q
+        base = s * n_actions
+        best = q[base]
+        choice = 0
+        ties = 1
+        for a in range(1, n_actions):
+            v = q[base + a]
+            if v > best:
+                best, choice, ties = v, a, 1
+            elif v == best:
+                ties += 1
+                if rng.random() * ties < 1:
+                    choice = a
+        return choice
+
+    '''
+    The value of a state that the update bootstraps from, given the action that will be taken there
+    '''
+    def _bootstrap(self, s, a):
+        q = self.q
+        n_actions = self.table.n_actions
+        base = s * n_actions
+        if self.algorithm == 'sarsa':
+            return q[base + a]
+        best = q[base]
+        total = 0
+        for i in range(n_actions):
+            v = q[base + i]
+            total += v
+            if v > best:
+                best = v
+        if self.algorithm == 'q_learning':
+            return best
+        # Under epsilon-greedy every action has probability epsilon / n_actions, and the greedy actions
+        # (which all have the best value) share the remaining 1 - epsilon
+        return self.epsilon * total / n_actions + (1 - self.epsilon) * best
+
+    '''
+    Runs one episode, updating the value table as it goes, and returns the number of steps it took.
+    This is n-step TD control as in section 7.2; with n = 1 it is the one-step algorithm.
+    '''
+    def episode(self):
+        table = self.table
+        n_actions, n_outcomes = table.n_actions, table.n_outcomes
+        next_states, rewards = table.next_states, table.rewards
+        q, n, alpha, gamma, rng = self.q, self.n, self.alpha, self.gamma, self.rng
+
+        # The last n + 1 states, actions and rewards, indexed by time step mod (n + 1)
+        states = [0] * (n + 1)
+        actions = [0] * (n + 1)
+        step_rewards = [0] * (n + 1)
+        states[0] = s = table.start
+        actions[0] = a = self.select(s)
+        end = float('inf')
+        t = 0
+        while True:
+            if t < end:
+                i = (s * n_actions + a) * n_outcomes
+                if n_outcomes > 1:
+                    i += rng.randrange(n_outcomes)
+                s, r = next_states[i], rewards[i]
+                states[(t + 1) % (n + 1)] = s
+                step_rewards[(t + 1) % (n + 1)] = r
+                if s == table.terminal:
+                    end = t + 1
+                else:
+                    a = self.select(s)
+                    actions[(t + 1) % (n + 1)] = a
+            # The time step whose estimate is updated
+            tau = t - n + 1
+            if tau >= 0:
+                g = 0
+                for k in range(min(tau + n, end), tau, -1):
+                    g = step_rewards[k % (n + 1)] + gamma * g
+                if tau + n < end:
+                    g += gamma ** n * self._bootstrap(states[(tau + n) % (n + 1)], actions[(tau + n) % (n + 1)])
+                i = states[tau % (n + 1)] * n_actions + actions[tau % (n + 1)]
+                q[i] += alpha * (g - q[i])
+            if tau == end - 1:
+                return end
+            t += 1
+
+    '''
+    Runs episodes until the total number of steps reaches steps, like the loop in windy_gridworld.py.
+    Returns the total step count and episode count at the end of each episode, and the steps per second.
+    '''
+    def run(self, steps):
+        step_values = [0]
+        episode_values = [0]
+        total = 0
+        start = time.time()
+        while total <= steps:
+            total += self.episode()
+            step_values.append(total)
+            episode_values.append(len(episode_values))
+        return step_values, episode_values, total / (time.time() - start)
+
+if __name__ == '__main__':
+    from windy_gridworld import Environment
+
+    for ex in (None, 9, 10):
+        table = windy_table(Environment(ex=ex))
+        for algorithm, n in (('sarsa', 1), ('expected_sarsa', 1), ('q_learning', 1), ('sarsa', 4), ('expected_sarsa', 4)):
+            engine = TDControl(table, algorithm, n=n, seed=0)
+            step_values, episode_values, steps_per_sec = engine.run(8000)
+            print(f"ex={ex}, {n}-step {algorithm}: {episode_values[-1]} episodes, {round(steps_per_sec)} steps/sec")
@@ -1,6 +1,8 @@
 import bresenham as br
 import time
 import random
+import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 
 # A state is a 2-tuple of the current position: (x_pos, y_pos)
@@ -32,6 +34,9 @@ class Environment:
             ]
         self.start_state = (1, 4)
         self.goal_state = (8, 4)
+        # The strength of the wind in each column, indexed by x position. Columns 0 and 11 are 
+        # just off the edges of the world, where a move can take the agent before it's clamped. 
+        self.wind = [0, 0, 0, 0, 1, 1, 1, 2, 2, 1, 0, 0]
     
     '''
     Generate reward and new state given state and action
@@ -44,16 +49,12 @@ class Environment:
         ypos += action[1]
 
         # account for wind (stochastic wind if ex 10)
-        if xpos in (4, 5, 6, 9):
+        wind = self.wind[xpos]
+        if wind:
             if self.ex == 10:
-                ypos += random.choice((0, 1, 2))
+                ypos += wind + random.choice((-1, 0, 1))
             else:
-                ypos += 1
-        if xpos in (7, 8):
-            if self.ex == 10:
-                ypos += random.choice((1, 2, 3))
-            else:
-                ypos += 2
+                ypos += wind
 
         # clamp to world limits
         xpos = min(max(xpos, 1), self.world_width)
@@ -90,7 +91,7 @@ class Agent:
     '''
     def epsilon_greedy_policy(self, state, epsilon):
         if random.uniform(0, 1) < epsilon:
-            return random.choice(env.actions)
+            return random.choice(self.env.actions)
         else:
             max_q = max([self.q[(state, a)] for a in self.env.actions])
             return random.choice([a for a in self.env.actions if self.q[(state, a)] == max_q])
@@ -101,45 +102,128 @@ class Agent:
     def sarsa_learn(self, lr, s1, a1, r, s2, a2):
         self.q[(s1, a1)] += lr * (r + self.q[(s2, a2)] - self.q[(s1, a1)])
 
-env = Environment(ex=10)
-agent = Agent(env)
-
-steps = 0
-episodes = 0
-
-step_values = [0]
-episode_values = [0]
-
-plt.xlabel("Time steps")
-plt.ylabel("Episodes")
-
-epsilon = 0.1
-lr = 0.5
-
-# The Sarsa algorithm as described in section 6.4
-while steps <= 8000:
-    state = env.start_state
-    action = agent.epsilon_greedy_policy(state, epsilon)
-    while state != env.goal_state:
-        reward, new_state = env.new_reward_state(state, action)
-        new_action = agent.epsilon_greedy_policy(new_state, epsilon)
-        agent.sarsa_learn(lr, state, action, reward, new_state, new_action)
-        state, action = new_state, new_action
-
-        steps += 1
-    episodes += 1
-    step_values.append(steps)
-    episode_values.append(episodes)
+'''
+The Sarsa algorithm as described in section 6.4, for a single agent, until the total number of time steps
+passes steps. Returns the agent, and the total steps and episodes at the end of each episode.
+'''
+def sarsa(env, steps, epsilon=0.1, lr=0.5):
+    agent = Agent(env)
+
+    total_steps = 0
+    episodes = 0
+
+    step_values = [0]
+    episode_values = [0]
+
+    while total_steps <= steps:
+        state = env.start_state
+        action = agent.epsilon_greedy_policy(state, epsilon)
+        while state != env.goal_state:
+            reward, new_state = env.new_reward_state(state, action)
+            new_action = agent.epsilon_greedy_policy(new_state, epsilon)
+            agent.sarsa_learn(lr, state, action, reward, new_state, new_action)
+            state, action = new_state, new_action
+
+            total_steps += 1
+        episodes += 1
+        step_values.append(total_steps)
+        episode_values.append(episodes)
+    return agent, step_values, episode_values
 
 '''
-# Show off our optimal policy with a single run
-state = env.start_state
-while state != env.goal_state:
-    reward, new_state = env.new_reward_state(state, action)
-    new_action = agent.epsilon_greedy_policy(new_state, epsilon)
-    state, action = new_state, new_action
-    env.visualise_state(state)
-    time.sleep(0.1)
+Runs Sarsa for many independent agents at once, all of them taking a step at the same time. 
+The value tables are held in one (agents x states x actions) array, and the wind, clamping, 
+epsilon-greedy action selection and Sarsa updates are all done for every agent in one go. 
+Returns the average number of episodes completed after each time step, from 0 to steps. 
 '''
-plt.plot(step_values, episode_values, color='b')
-plt.show()
+def batched_sarsa(env, n_agents, steps, epsilon=0.1, lr=0.5, seed=None):
+    rng = np.random.default_rng(seed)
+    agents = np.arange(n_agents)
+    actions = np.array(env.actions)
+    n_actions = len(actions)
+    wind = np.array(env.wind)
+    width, height = env.world_width, env.world_height
+    # States are indexed by (x - 1) * height + (y - 1)
+    goal = (env.goal_state[0] - 1) * height + env.goal_state[1] - 1
+    start = (env.start_state[0] - 1) * height + env.start_state[1] - 1
+
+    # The value tables of all the agents, flattened to one row per (agent, state)
+    q = np.full((n_agents, width * height, n_actions), -50.0)
+    q[:, goal] = 0
+    q = q.reshape(-1, n_actions)
+    offsets = agents * width * height
+
+    # Random tie-breaking: the argmax of random keys among the maximal actions
+    def epsilon_greedy(rows):
+        values = q[rows]
+        ties = values == values.max(axis=1, keepdims=True)
+        chosen = np.argmax(np.where(ties, rng.random(values.shape), -1), axis=1)
+        explore = rng.random(len(rows)) < epsilon
+        chosen[explore] = rng.integers(0, n_actions, size=np.count_nonzero(explore))
+        return chosen
+
+    states = np.full(n_agents, start)
+    action = epsilon_greedy(offsets + states)
+    episodes = np.zeros(n_agents)
+    average_episodes = np.zeros(steps + 1)
+    for t in range(1, steps + 1):
+        xs = states // height + 1 + actions[action, 0]
+        ys = states % height + 1 + actions[action, 1]
+        column_wind = wind[xs]
+        if env.ex == 10:
+            column_wind = np.where(column_wind > 0, column_wind + rng.integers(-1, 2, size=n_agents), 0)
+        xs = np.clip(xs, 1, width)
+        ys = np.clip(ys + column_wind, 1, height)
+        new_states = (xs - 1) * height + ys - 1
+        done = new_states == goal
+        rewards = np.where(done, 0, -1)
+
+        rows = offsets + states
+        new_rows = offsets + new_states
+        new_action = epsilon_greedy(new_rows)
+        q[rows, action] += lr * (rewards + q[new_rows, new_action] - q[rows, action])
+
+        # Agents that reached the goal start a new episode
+        episodes += done
+        new_states[done] = start
+        new_action[done] = epsilon_greedy(offsets[done] + start)
+        states, action = new_states, new_action
+        average_episodes[t] = episodes.mean()
+    return average_episodes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sarsa on the windy gridworld (Example 6.5, Exercises 6.9 and 6.10)")
+    parser.add_argument('--ex', default='10', choices=('example', '9', '10'), 
+                        help="the exercise to solve, or 'example' for the original example")
+    parser.add_argument('--agents', type=int, default=None, help="average the learning curve over this many agents")
+    args = parser.parse_args()
+
+    env = Environment(ex=None if args.ex == 'example' else int(args.ex))
+
+    plt.xlabel("Time steps")
+    plt.ylabel("Episodes")
+
+    epsilon = 0.1
+    lr = 0.5
+
+    if args.agents is not None:
+        t = time.time()
+        average_episodes = batched_sarsa(env, args.agents, 8000, epsilon, lr)
+        print(f"{args.agents} agents trained in {round(time.time() - t, 2)}s")
+        plt.plot(range(8001), average_episodes, color='b')
+        plt.show()
+    else:
+        agent, step_values, episode_values = sarsa(env, 8000, epsilon, lr)
+
+        '''
+        # Show off our optimal policy with a single run
+        state = env.start_state
+        while state != env.goal_state:
+            reward, new_state = env.new_reward_state(state, action)
+            new_action = agent.epsilon_greedy_policy(new_state, epsilon)
+            state, action = new_state, new_action
+            env.visualise_state(state)
+            time.sleep(0.1)
+        '''
+        plt.plot(step_values, episode_values, color='b')
+        plt.show()
@@ -0,0 +1,249 @@
+'''
+Benchmarks for the hot paths of every chapter, so that speedups and slowdowns are measured rather than guessed.
+Each workload is run at a few problem sizes with a fixed seed, and its wall times are written to a JSON file. The
+results can be compared against a stored baseline (baseline.json next to this file by default): any workload that
+is slower than the baseline by more than its threshold counts as a regression, and the script exits with status 1.
+
+    python benchmarks/benchmark.py                          run everything and compare against the baseline
+    python benchmarks/benchmark.py --only racecar_learn     run some of the workloads
+    python benchmarks/benchmark.py --save-baseline          store the results as the new baseline
+
+Timings depend on the machine, so a baseline should be saved on the machine it's compared on.
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The chapters aren't packages, so put each of their directories on the path to import their modules directly
+for directory in ('2-k_armed_bandits', '4-dynamic_programming', '5-monte_carlo_methods',
+                  '6-temporal_difference_learning', 'openai-gym'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+import bandit_testbed
+import car_rental
+import gamblers_problem
+import racecar
+import td_control
+import windy_gridworld
+from example_envs.grid_world import GridWorldEnv
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+'''
+Each workload is a function of (size, seed) which does any setup that shouldn't be timed, seeds everything it uses,
+and returns the function to be timed.
+'''
+
+def bandit_epsilon_greedy(size, seed):
+    return lambda: bandit_testbed.run_testbed(size, 1000, seed=seed, epsilon=0.1)
+
+def bandit_ucb(size, seed):
+    return lambda: bandit_testbed.run_testbed(size, 1000, seed=seed, c=2)
+
+def car_rental_evaluate_improve(size, seed):
+    model = car_rental.CarRentalModel(max_cars=size)
+    policy = np.zeros(model.shape, dtype=int)
+    values = np.zeros(model.shape)
+
+    def run():
+        new_values = car_rental.evaluate(values, policy, model)
+        car_rental.improve(policy, new_values, model)
+    return run
+
+def car_rental_policy_iteration(size, seed):
+    model = car_rental.CarRentalModel(max_cars=size)
+    return lambda: car_rental.policy_iteration(model)
+
+def gamblers_value_iteration(size, seed):
+    return lambda: gamblers_problem.value_iteration(1e-9, goal=size)
+
+# Building the racetrack's tables takes a while and doesn't change, so it's shared between repeats
+_racecar_env = None
+
+def _racecar_agent(seed):
+    global _racecar_env
+    if _racecar_env is None:
+        _racecar_env = racecar.Environment()
+    random.seed(seed)
+    return racecar.Agent(_racecar_env)
+
+def racecar_learn(size, seed):
+    agent = _racecar_agent(seed)
+    return lambda: agent.learn(size)
+
+def racecar_generate_trajectory(size, seed):
+    agent = _racecar_agent(seed)
+    rng = random.Random(seed)
+    return lambda: [agent.generate_trajectory(rng=rng) for _ in range(size)]
+
+def racecar_evaluate_policy(size, seed):
+    agent = _racecar_agent(seed)
+    return lambda: racecar.evaluate_policy(agent, restarts=size, seed=seed)
+
+def windy_sarsa(size, seed):
+    env = windy_gridworld.Environment(ex=10)
+
+    def run():
+        random.seed(seed)
+        windy_gridworld.sarsa(env, size)
+    return run
+
+def windy_batched_sarsa(size, seed):
+    env = windy_gridworld.Environment(ex=10)
+    return lambda: windy_gridworld.batched_sarsa(env, size, 8000, seed=seed)
+
+def td_control_sarsa(size, seed):
+    table = td_control.windy_table(windy_gridworld.Environment(ex=10))
+    return lambda: td_control.TDControl(table, 'sarsa', seed=seed).run(size)
+
+def gridworld_env_step(size, seed):
+    env = GridWorldEnv(size=size)
+    actions = np.random.default_rng(seed).integers(0, 4, size=10000).tolist()
+
+    def run():
+        env.reset(seed=seed)
+        for action in actions:
+            obs, reward, terminated, truncated, info = env.step(action)
+            if terminated:
+                env.reset()
+    return run
+
+'''
+Maps each workload's name to its function, the problem sizes to run it at, and its regression threshold
+(the fraction slower than the baseline that's tolerated), or None to use the threshold given on the command line.
+'''
+WORKLOADS = {
+    'bandit_epsilon_greedy': (bandit_epsilon_greedy, (200, 2000), None),
+    'bandit_ucb': (bandit_ucb, (200, 2000), None),
+    'car_rental_evaluate_improve': (car_rental_evaluate_improve, (20, 30), None),
+    'car_rental_policy_iteration': (car_rental_policy_iteration, (20, 30), None),
+    'gamblers_value_iteration': (gamblers_value_iteration, (1000, 10000), None),
+    'racecar_learn': (racecar_learn, (10, 100), None),
+    'racecar_generate_trajectory': (racecar_generate_trajectory, (10, 100), None),
+    'racecar_evaluate_policy': (racecar_evaluate_policy, (10, 100), None),
+    'windy_sarsa': (windy_sarsa, (8000, 32000), None),
+    'windy_batched_sarsa': (windy_batched_sarsa, (100, 1000), None),
+    'td_control_sarsa': (td_control_sarsa, (8000, 32000), None),
+    # Environment steps are quick, so their timings are noisier
+    'gridworld_env_step': (gridworld_env_step, (5, 100), 0.5),
+}
+
+'''
+Runs a workload at one size repeat times, setting it up afresh each time, and returns its wall times
+'''
+def time_workload(workload, size, seed=0, repeat=3):
+    times = []
+    for _ in range(repeat):
+        run = workload(size, seed)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+'''
+Runs the named workloads (all of them by default) at each of their sizes.
+Returns the results as a dict: the machine the benchmarks ran on, and for each workload and size,
+the fastest and median of the wall times and the times themselves.
+'''
+def run_benchmarks(names=None, repeat=3, seed=0, verbose=False):
+    results = dict()
+    for name in names or WORKLOADS:
+        workload, sizes, threshold = WORKLOADS[name]
+        results[name] = dict()
+        for size in sizes:
+            times = time_workload(workload, size, seed, repeat)
+            results[name][str(size)] = {'min': min(times), 'median': statistics.median(times), 'times': times}
+            if verbose:
+                print(f"{name} (size {size}): {min(times):.4f}s")
+    return {'machine': {'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'platform': platform.platform(),
+                        'processor': platform.processor()},
+            'seed': seed,
+            'repeat': repeat,
+            'results': results}
+
+'''
+Compares the fastest times of the results with the baseline's. A workload is a regression if it's slower than the
+baseline by more than its threshold, or an improvement if it's faster by more than the threshold.
+thresholds: optionally a dict of thresholds for particular workloads, overriding the threshold of WORKLOADS and the
+default threshold.
+Returns a list of (name, size, baseline time, time, ratio, verdict) rows, for every workload and size in both.
+'''
+def compare(results, baseline, threshold=0.25, thresholds=None):
+    thresholds = thresholds or dict()
+    rows = []
+    for name, sizes in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        limit = thresholds.get(name, WORKLOADS[name][2] if name in WORKLOADS else None)
+        if limit is None:
+            limit = threshold
+        for size, timing in sizes.items():
+            if size not in baseline['results'][name]:
+                continue
+            before = baseline['results'][name][size]['min']
+            ratio = timing['min'] / before
+            if ratio > 1 + limit:
+                verdict = 'regression'
+            elif ratio < 1 - limit:
+                verdict = 'improvement'
+            else:
+                verdict = 'ok'
+            rows.append((name, size, before, timing['min'], ratio, verdict))
+    return rows
+
+def print_comparison(rows):
+    print(f"{'workload':<30}{'size':>8}{'baseline':>12}{'now':>12}{'ratio':>8}  verdict")
+    for name, size, before, now, ratio, verdict in rows:
+        print(f"{name:<30}{size:>8}{before:>11.4f}s{now:>11.4f}s{ratio:>8.2f}  {verdict}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of each chapter")
+    parser.add_argument('--only', nargs='+', choices=list(WORKLOADS), help="the workloads to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="times to run each workload at each size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="the baseline JSON file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="the fraction slower than the baseline that counts as a regression")
+    parser.add_argument('--threshold-for', nargs=2, action='append', default=[], metavar=('WORKLOAD', 'THRESHOLD'),
+                        help="a different threshold for one workload")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.repeat, args.seed, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        # Keep the baseline of any workloads that weren't run this time
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline['results'].update(results['results'])
+            baseline['machine'] = results['machine']
+            results = baseline
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold, {name: float(t) for name, t in args.threshold_for})
+        print()
+        print_comparison(rows)
+        if any(row[5] == 'regression' for row in rows):
+            sys.exit(1)
+    else:
+        print(f"No baseline at {args.baseline} to compare against")
@@ -4,10 +4,12 @@ make it available to be imported
 '''
 
 from example_envs.grid_world import GridWorldEnv
+from example_envs.grid_world_vector import GridWorldVectorEnv
 from gymnasium.envs.registration import register
 
 register(
     id='example_envs/GridWorld-v0',
     entry_point='example_envs:GridWorldEnv',
+    vector_entry_point='example_envs:GridWorldVectorEnv',
     max_episode_steps=300
 )
\ No newline at end of file
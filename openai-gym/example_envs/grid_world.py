@@ -7,9 +7,28 @@ There are 25 * 24 = 600 possible states (agent position and target position).
 
 import gymnasium as gym
 from gymnasium import spaces
-import pygame 
 import numpy as np
 
+'''
+The static part of an rgb_array frame (the white background and the grid lines) only depends on the 
+grid size and window size, so it's drawn once for each and kept here. Maps (size, window_size) to the 
+background image and a mask of which rows (or columns) of pixels are grid lines. 
+'''
+_backgrounds = {}
+
+def _grid_background(size, window_size):
+    if (size, window_size) not in _backgrounds:
+        pix_square_size = window_size / size
+        lines = np.zeros(window_size, dtype=bool)
+        for x in range(size + 1):
+            p = int(pix_square_size * x)
+            lines[max(p - 1, 0):p + 2] = True # Lines are 3 pixels wide
+        background = np.full((window_size, window_size, 3), 255, dtype=np.uint8)
+        background[lines] = 0
+        background[:, lines] = 0
+        _backgrounds[(size, window_size)] = (background, lines)
+    return _backgrounds[(size, window_size)]
+
 class GridWorldEnv(gym.Env):
     '''
     The env class must inherit from the abstract class gym.Env. 
@@ -81,9 +100,39 @@ class GridWorldEnv(gym.Env):
 
     def render(self):
         if self.render_mode == 'rgb_array':
-            self._render_frame()
+            return self._render_rgb_array()
+
+    '''
+    Draws a frame with numpy alone, so no pygame is needed for headless recording. Only the target and 
+    agent are drawn onto a copy of the cached background, and the grid lines are left on top of them. 
+    Frames are (window_size x window_size x 3) arrays, indexed [y, x] as in the pygame version. 
+    '''
+    def _render_rgb_array(self):
+        background, lines = _grid_background(self.size, self.window_size)
+        frame = background.copy()
+        pix_square_size = self.window_size / self.size
+
+        # The target is a red square filling its cell
+        x0, y0 = (pix_square_size * self._target_location).astype(int)
+        x1, y1 = x0 + int(pix_square_size), y0 + int(pix_square_size)
+        cell = ~lines[y0:y1, None] & ~lines[None, x0:x1]
+        frame[y0:y1, x0:x1][cell] = (255, 0, 0)
+
+        # The agent is a blue circle in the middle of its cell
+        cx, cy = (self._agent_location + 0.5) * pix_square_size
+        radius = pix_square_size / 3
+        x0, y0 = int(cx - radius), int(cy - radius)
+        x1, y1 = min(int(np.ceil(cx + radius)), self.window_size), min(int(np.ceil(cy + radius)), self.window_size)
+        ys, xs = np.arange(y0, y1) + 0.5, np.arange(x0, x1) + 0.5
+        circle = ((ys[:, None] - cy) ** 2 + (xs[None, :] - cx) ** 2 <= radius ** 2)
+        circle &= ~lines[y0:y1, None] & ~lines[None, x0:x1]
+        frame[y0:y1, x0:x1][circle] = (0, 0, 255)
+        return frame
 
     def _render_frame(self):
+        # pygame is only needed to draw to a window
+        import pygame
+
         if self.window is None and self.render_mode == 'human':
             pygame.init()
             pygame.display.init()
@@ -127,16 +176,12 @@ class GridWorldEnv(gym.Env):
                 width=3
             )
 
-        if self.render_mode == 'human':
-            self.window.blit(canvas, canvas.get_rect())
-            pygame.event.pump()
-            pygame.display.update()
-            self.clock.tick(self.metadata['render_fps'])
-        else:
-            return np.transpose(
-                np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2)
-            )
+        self.window.blit(canvas, canvas.get_rect())
+        pygame.event.pump()
+        pygame.display.update()
+        self.clock.tick(self.metadata['render_fps'])
     def close(self):
         if self.window is not None:
+            import pygame
             pygame.display.quit()
             pygame.quit()
\ No newline at end of file
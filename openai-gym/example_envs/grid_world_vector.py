@@ -0,0 +1,82 @@
+'''
+A vectorised version of the gridworld environment in grid_world.py, following gymnasium's vector environment API.
+Instead of wrapping num_envs copies of GridWorldEnv, the agent and target locations of every world are held in
+(num_envs x 2) arrays and all of the worlds are stepped at once. Worlds that finish are reset straight away
+(gymnasium's "same step" autoreset), so the observations returned for them are the first of their next episode.
+Their last observations are returned in info["final_obs"], masked by info["_final_obs"]: an array of the
+observation of every world, in which only the finished worlds differ from the returned observations.
+Create it with gym.make_vec('example_envs/GridWorld-v0', num_envs=...).
+'''
+
+import gymnasium as gym
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+import numpy as np
+
+class GridWorldVectorEnv(gym.vector.VectorEnv):
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs=1, size=5, max_episode_steps=None):
+        self.num_envs = num_envs
+        self.size = size
+        self.max_episode_steps = max_episode_steps
+
+        self.single_observation_space = spaces.Discrete(size ** 4)
+        self.single_action_space = spaces.Discrete(4)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        # The same mapping from actions to directions as GridWorldEnv, as an array indexed by action
+        self._action_to_direction = np.array([[0, 1], [1, 0], [0, -1], [-1, 0]])
+
+        self._agent_location = np.zeros((num_envs, 2), dtype=np.int64)
+        self._target_location = np.zeros((num_envs, 2), dtype=np.int64)
+        self._elapsed_steps = np.zeros(num_envs, dtype=np.int64)
+
+    def _get_obs(self):
+        location_agent = self._agent_location[:, 0] * self.size + self._agent_location[:, 1]
+        location_target = self._target_location[:, 0] * self.size + self._target_location[:, 1]
+        return location_agent * (self.size ** 2) + location_target
+
+    '''
+    Place the agent and target of the masked worlds at random, with the target never on the agent.
+    Rather than redrawing the target until it's different, it's drawn from the other size ** 2 - 1 cells.
+    '''
+    def _reset_worlds(self, mask):
+        n = np.count_nonzero(mask)
+        if n == 0:
+            return
+        cells = self.size ** 2
+        agent = self.np_random.integers(0, cells, size=n)
+        target = self.np_random.integers(0, cells - 1, size=n)
+        target += target >= agent
+        self._agent_location[mask] = np.stack((agent // self.size, agent % self.size), axis=1)
+        self._target_location[mask] = np.stack((target // self.size, target % self.size), axis=1)
+        self._elapsed_steps[mask] = 0
+
+    def reset(self, seed=None, options=None):
+        if seed is not None:
+            self._np_random, self._np_random_seed = gym.utils.seeding.np_random(seed)
+        self._reset_worlds(np.ones(self.num_envs, dtype=bool))
+        return self._get_obs(), {}
+
+    def step(self, actions):
+        self._agent_location += self._action_to_direction[actions]
+        np.clip(self._agent_location, 0, self.size - 1, out=self._agent_location)
+        self._elapsed_steps += 1
+
+        terminated = (self._agent_location == self._target_location).all(axis=1)
+        if self.max_episode_steps is not None:
+            truncated = ~terminated & (self._elapsed_steps >= self.max_episode_steps)
+        else:
+            truncated = np.zeros(self.num_envs, dtype=bool)
+        rewards = np.full(self.num_envs, -1)
+
+        done = terminated | truncated
+        info = {}
+        if done.any():
+            info = {'final_obs': self._get_obs(), '_final_obs': done,
+                    'final_info': {}, '_final_info': done}
+        self._reset_worlds(done)
+        return self._get_obs(), rewards, terminated, truncated, info
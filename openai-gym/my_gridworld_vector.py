@@ -0,0 +1,58 @@
+'''
+Here I'm testing the vectorised gridworld environment, training tabular Q-learning 
+on batches of transitions from many gridworlds at once. 
+'''
+
+import gymnasium as gym
+import example_envs
+import time
+import numpy as np
+
+'''
+Q-learning over a vector env. Every step, each world's action is chosen epsilon-greedily and its 
+transition is used to update the Q table, all in one go. If two worlds update the same (state, action) 
+in the same step, only one of the updates is kept. 
+'''
+def train(env, q_table, steps, alpha=0.1, gamma=1, epsilon=0.1, seed=None):
+    rng = np.random.default_rng(seed)
+    n = env.num_envs
+    n_actions = q_table.shape[1]
+    state, info = env.reset(seed=seed)
+    episodes = 0
+    for _ in range(steps):
+        action = np.argmax(q_table[state], axis=1)
+        explore = rng.random(n) < epsilon
+        action[explore] = rng.integers(0, n_actions, size=np.count_nonzero(explore))
+        next_state, reward, terminated, truncated, info = env.step(action)
+
+        # Update the q-values. Finished worlds have already been reset, so truncated worlds bootstrap from 
+        # their last observation. Terminated transitions don't bootstrap, so the next state doesn't matter for them. 
+        last_state = np.where(truncated, info['final_obs'], next_state) if truncated.any() else next_state
+        target = reward + gamma * np.max(q_table[last_state], axis=1) * ~terminated
+        q_table[state, action] = (1 - alpha) * q_table[state, action] + alpha * target
+
+        state = next_state
+        episodes += np.count_nonzero(terminated | truncated)
+    return episodes
+
+if __name__ == '__main__':
+    env = gym.make_vec('example_envs/GridWorld-v0', num_envs=1024)
+    q_table = np.zeros([env.single_observation_space.n, env.single_action_space.n])
+
+    steps = 2000
+    t = time.time()
+    episodes = train(env, q_table, steps, seed=0)
+    duration = time.time() - t
+    print(f"{episodes} episodes, {round(steps * env.num_envs / duration)} transitions/sec")
+    env.close()
+
+    # Show off the learned policy in the original environment
+    env = gym.make('example_envs/GridWorld-v0', render_mode='human')
+    obs, info = env.reset()
+
+    for _ in range(1000):
+        action = np.argmax(q_table[obs])
+        obs, reward, done, truncated, info = env.step(action)
+        if done:
+            break
+        time.sleep(0.3)
@@ -0,0 +1,180 @@
+'''
+Model-based planning for the tabular Q-learning in q_learning.py: Dyna-Q and prioritized sweeping (section 8.2 and
+section 8.4 of Reinforcement Learning - An Introduction, Sutton & Barto).
+Plain Q-learning uses each real transition for one update and then throws it away. The planners here also record
+every observed transition in a tabular model, and after each real step use the model to make more updates:
+Dyna-Q replays uniformly random remembered transitions, while prioritized sweeping works back from the transitions
+whose values are most out of date. Both are passed to q_learning.train as its planner.
+The environments here (GridWorld and Taxi) are deterministic, so the model keeps the latest outcome of each
+(state, action).
+'''
+
+import argparse
+import heapq
+import random
+from collections import deque
+
+import numpy as np
+
+from q_learning import train
+
+'''
+The observed (state, action) -> (reward, next state, terminated) transitions. Transitions are stored in flat lists
+indexed by the order they were first seen, so that one can be sampled uniformly by picking a random index.
+'''
+class TabularModel:
+    def __init__(self):
+        self._index = dict() # Maps (state, action) to its index in the lists below
+        self.states = []
+        self.actions = []
+        self.rewards = []
+        self.next_states = []
+        self.terminated = []
+        self._predecessors = dict() # Maps each state to the set of (state, action) pairs seen to lead to it
+
+    def add(self, state, action, reward, next_state, terminated):
+        key = (state, action)
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self.states)
+            self.states.append(state)
+            self.actions.append(action)
+            self.rewards.append(reward)
+            self.next_states.append(next_state)
+            self.terminated.append(terminated)
+        else:
+            if self.next_states[i] != next_state:
+                self._predecessors[self.next_states[i]].discard(key)
+            self.rewards[i] = reward
+            self.next_states[i] = next_state
+            self.terminated[i] = terminated
+        self._predecessors.setdefault(next_state, set()).add(key)
+
+    def get(self, state, action):
+        i = self._index[(state, action)]
+        return self.rewards[i], self.next_states[i], self.terminated[i]
+
+    '''
+    The (state, action) pairs that have been seen to lead to a state
+    '''
+    def predecessors(self, state):
+        return self._predecessors.get(state, ())
+
+    def __len__(self):
+        return len(self.states)
+
+'''
+Dyna-Q: after each real step, make planning_steps Q-learning updates on transitions drawn uniformly from the model
+'''
+class DynaQ:
+    def __init__(self, planning_steps=10, alpha=0.1, gamma=1, seed=None):
+        self.planning_steps = planning_steps
+        self.alpha = alpha
+        self.gamma = gamma
+        self.rng = random.Random(seed)
+        self.model = TabularModel()
+        self.updates = 0
+
+    def update(self, q_table, state, action, reward, next_state, terminated):
+        model = self.model
+        model.add(state, action, reward, next_state, terminated)
+        alpha, gamma = self.alpha, self.gamma
+        for _ in range(self.planning_steps):
+            i = self.rng.randrange(len(model))
+            s, a = model.states[i], model.actions[i]
+            target = model.rewards[i] + gamma * np.max(q_table[model.next_states[i]]) * (not model.terminated[i])
+            q_table[s, a] = (1 - alpha) * q_table[s, a] + alpha * target
+        self.updates += self.planning_steps
+
+'''
+Prioritized sweeping: (state, action) pairs are queued by the size of their TD error, if it's over theta.
+After each real step, the pair that was just taken is queued, then up to planning_steps pairs are popped and updated
+in order of priority. Every update changes the value of a state, so the pairs seen to lead to that state are queued
+in turn.
+'''
+class PrioritizedSweeping:
+    def __init__(self, planning_steps=10, alpha=0.1, gamma=1, theta=1e-4):
+        self.planning_steps = planning_steps
+        self.alpha = alpha
+        self.gamma = gamma
+        self.theta = theta
+        self.model = TabularModel()
+        # heapq is a min-heap, so priorities are negated. A pair is pushed again whenever its priority rises, so the
+        # current priority of each queued pair is kept alongside and out of date entries are skipped.
+        self._queue = []
+        self._priorities = dict()
+        self.updates = 0
+
+    def _error(self, q_table, state, action):
+        reward, next_state, terminated = self.model.get(state, action)
+        target = reward + self.gamma * np.max(q_table[next_state]) * (not terminated)
+        return target, abs(target - q_table[state, action])
+
+    def _push(self, q_table, state, action):
+        target, priority = self._error(q_table, state, action)
+        key = (state, action)
+        if priority > self.theta and priority > self._priorities.get(key, 0):
+            self._priorities[key] = priority
+            heapq.heappush(self._queue, (-priority, key))
+
+    def update(self, q_table, state, action, reward, next_state, terminated):
+        self.model.add(state, action, reward, next_state, terminated)
+        self._push(q_table, state, action)
+        alpha = self.alpha
+        n = 0
+        while self._queue and n < self.planning_steps:
+            priority, key = heapq.heappop(self._queue)
+            if self._priorities.get(key) != -priority:
+                continue
+            del self._priorities[key]
+            s, a = key
+            target, _ = self._error(q_table, s, a)
+            q_table[s, a] = (1 - alpha) * q_table[s, a] + alpha * target
+            n += 1
+            for s_prev, a_prev in self.model.predecessors(s):
+                self._push(q_table, s_prev, a_prev)
+        self.updates += n
+
+'''
+Trains with q_learning.train until the mean return of the last window episodes reaches target_return, or until
+max_episodes. planner is None for plain Q-learning.
+Returns the number of real environment steps it took (None if the target wasn't reached) and the TrainingStats.
+'''
+def steps_to_target(env, target_return, planner=None, window=20, max_episodes=5000, alpha=0.1, gamma=1,
+                    epsilon=0.1, seed=None):
+    q_table = np.zeros([env.observation_space.n, env.action_space.n])
+    returns = deque(maxlen=window)
+
+    def reached(episode, length, episode_return):
+        returns.append(episode_return)
+        return len(returns) == window and np.mean(returns) >= target_return
+
+    stats = train(env, q_table, max_episodes, alpha, gamma, epsilon, seed=seed, callback=reached, planner=planner)
+    success = len(returns) == window and np.mean(returns) >= target_return
+    return (stats.steps if success else None), stats
+
+if __name__ == '__main__':
+    import gymnasium as gym
+    import example_envs
+
+    parser = argparse.ArgumentParser(description="Compare Q-learning, Dyna-Q and prioritized sweeping")
+    parser.add_argument('--planning-steps', type=int, default=10)
+    parser.add_argument('--seeds', type=int, default=3)
+    args = parser.parse_args()
+
+    # The target returns are a little below the best mean return an epsilon-greedy policy can get
+    problems = (('example_envs/GridWorld-v0', 1, -6), ('Taxi-v4', 0.9, 0))
+    for env_id, gamma, target_return in problems:
+        env = gym.make(env_id)
+        print(f"{env_id}, target return {target_return}:")
+        planners = (('Q-learning', lambda seed: None),
+                    ('Dyna-Q', lambda seed: DynaQ(args.planning_steps, gamma=gamma, seed=seed)),
+                    ('Prioritized sweeping', lambda seed: PrioritizedSweeping(args.planning_steps, gamma=gamma)))
+        for name, make_planner in planners:
+            results = [steps_to_target(env, target_return, make_planner(seed), gamma=gamma, seed=seed)
+                       for seed in range(args.seeds)]
+            steps = [n for n, stats in results if n is not None]
+            time = sum(stats.time for n, stats in results) / len(results)
+            print(f"  {name}: reached in {len(steps)}/{len(results)} runs, "
+                  f"{round(np.mean(steps)) if steps else '-'} real steps on average, {round(time, 2)}s per run")
+        env.close()
@@ -0,0 +1,200 @@
+'''
+A shared tabular Q-learning trainer for any gymnasium environment with discrete observation and action spaces,
+such as example_envs/GridWorld-v0 or Taxi-v3, in place of the loop that my_gridworld.py and taxi.ipynb each wrote out.
+As well as training, it measures where the time goes: the time spent stepping the environment against the time
+spent choosing actions and updating the Q table, plus the length and return of each episode. These are kept as
+running aggregates, so memory doesn't grow with the number of episodes. Per-episode rows can optionally be
+streamed to a CSV file, and the summary saved as JSON.
+'''
+
+import argparse
+import csv
+import json
+import math
+import time
+
+import numpy as np
+
+'''
+The count, mean, variance, min and max of a stream of numbers, updated one number at a time (Welford's algorithm)
+'''
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0
+        self._m2 = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std(), 'min': self.min, 'max': self.max}
+
+'''
+Everything that train measures. Pass the same TrainingStats to several calls of train to keep adding to it.
+Times are in seconds. Whatever isn't spent in env_time, select_time, update_time or planning_time is the loop's own
+overhead.
+'''
+class TrainingStats:
+    def __init__(self):
+        self.steps = 0
+        self.episodes = 0
+        self.time = 0
+        self.env_time = 0
+        self.select_time = 0
+        self.update_time = 0
+        self.planning_time = 0
+        self.length = RunningStats()
+        self.episode_return = RunningStats()
+
+    def steps_per_sec(self):
+        return self.steps / self.time if self.time > 0 else 0
+
+    def summary(self):
+        return {'steps': self.steps,
+                'episodes': self.episodes,
+                'time': self.time,
+                'steps_per_sec': self.steps_per_sec(),
+                'env_time': self.env_time,
+                'select_time': self.select_time,
+                'update_time': self.update_time,
+                'planning_time': self.planning_time,
+                'episode_length': self.length.summary(),
+                'episode_return': self.episode_return.summary()}
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def __str__(self):
+        return (f"{self.episodes} episodes, {self.steps} steps in {round(self.time, 2)}s "
+                f"({round(self.steps_per_sec())} steps/sec): env {round(self.env_time, 2)}s, "
+                f"select {round(self.select_time, 2)}s, update {round(self.update_time, 2)}s, "
+                f"planning {round(self.planning_time, 2)}s. "
+                f"Episode length {round(self.length.mean, 1)} +- {round(self.length.std(), 1)}, "
+                f"return {round(self.episode_return.mean, 1)} +- {round(self.episode_return.std(), 1)}")
+
+'''
+Trains q_table with one-step Q-learning and an epsilon-greedy behaviour policy for the given number of episodes.
+q_table is indexed by q_table[state] and q_table[state, action], so a numpy array or a SparseQTable both work.
+Episodes end when they terminate or are truncated, and terminal transitions don't bootstrap.
+stats: a TrainingStats to add to. A new one is made if this is None. It's returned either way.
+csv_path: if set, a row of (episode, length, return, steps so far) is written for each episode.
+profiler: anything that can be used as a context manager, e.g. a cProfile.Profile, which wraps the training loop.
+callback: if set, it's called as callback(episode, length, episode_return) at the end of every episode.
+If it returns True, training stops there.
+planner: optionally a model-based planner from planning.py. After each real step and its update, it's called as
+planner.update(q_table, state, action, reward, next_state, terminated) to learn from the step and run its
+planning updates.
+'''
+def train(env, q_table, episodes, alpha=0.1, gamma=1, epsilon=0.1, seed=None, stats=None, csv_path=None,
+          profiler=None, callback=None, planner=None):
+    if stats is None:
+        stats = TrainingStats()
+    rng = np.random.default_rng(seed)
+    n_actions = env.action_space.n
+    clock = time.perf_counter
+
+    csv_file = writer = None
+    if csv_path is not None:
+        csv_file = open(csv_path, 'w', newline='')
+        writer = csv.writer(csv_file)
+        writer.writerow(['episode', 'length', 'return', 'steps'])
+
+    start = clock()
+    try:
+        if profiler is not None:
+            profiler.__enter__()
+        for episode in range(episodes):
+            # Only the first reset is seeded, which seeds the environment's generator for the rest of the run
+            state, info = env.reset(seed=seed if episode == 0 else None)
+            length = 0
+            episode_return = 0
+            done = False
+            while not done:
+                t0 = clock()
+                if rng.random() < epsilon:
+                    action = int(rng.integers(n_actions))
+                else:
+                    action = int(np.argmax(q_table[state]))
+                t1 = clock()
+                next_state, reward, terminated, truncated, info = env.step(action)
+                t2 = clock()
+
+                # Update the q-value
+                target = reward + gamma * np.max(q_table[next_state]) * (not terminated)
+                q_table[state, action] = (1 - alpha) * q_table[state, action] + alpha * target
+                t3 = clock()
+                if planner is not None:
+                    planner.update(q_table, state, action, reward, next_state, terminated)
+                    stats.planning_time += clock() - t3
+
+                stats.select_time += t1 - t0
+                stats.env_time += t2 - t1
+                stats.update_time += t3 - t2
+                state = next_state
+                length += 1
+                episode_return += reward
+                done = terminated or truncated
+
+            stats.steps += length
+            stats.episodes += 1
+            stats.length.add(length)
+            stats.episode_return.add(episode_return)
+            if writer is not None:
+                writer.writerow([stats.episodes, length, episode_return, stats.steps])
+            if callback is not None and callback(stats.episodes, length, episode_return):
+                break
+    finally:
+        if profiler is not None:
+            profiler.__exit__(None, None, None)
+        stats.time += clock() - start
+        if csv_file is not None:
+            csv_file.close()
+    return stats
+
+if __name__ == '__main__':
+    import gymnasium as gym
+    import example_envs
+
+    parser = argparse.ArgumentParser(description="Instrumented tabular Q-learning")
+    parser.add_argument('--env', default='example_envs/GridWorld-v0', help="a gymnasium environment id, e.g. Taxi-v3")
+    parser.add_argument('--episodes', type=int, default=2000)
+    parser.add_argument('--alpha', type=float, default=0.1)
+    parser.add_argument('--gamma', type=float, default=1)
+    parser.add_argument('--epsilon', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help="write per-episode stats to this CSV file")
+    parser.add_argument('--json', help="write the summary to this JSON file")
+    parser.add_argument('--profile', action='store_true', help="profile the training loop with cProfile")
+    args = parser.parse_args()
+
+    env = gym.make(args.env)
+    q_table = np.zeros([env.observation_space.n, env.action_space.n])
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    stats = train(env, q_table, args.episodes, args.alpha, args.gamma, args.epsilon, seed=args.seed,
+                  csv_path=args.csv, profiler=profiler)
+    env.close()
+    print(stats)
+    if args.json:
+        stats.save_json(args.json)
+    if profiler is not None:
+        import pstats
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
@@ -0,0 +1,151 @@
+'''
+A Q-table that only stores the rows of states that have actually been visited, for environments whose
+observation spaces are far too big for a dense np.zeros([observation_space.n, action_space.n]) table
+(e.g. GridWorldEnv with size=100 has 10^8 states). It is indexed the same way as the dense table:
+q_table[state] gives a row and q_table[state, action] a single value, and either can be assigned to.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+class SparseQTable:
+    '''
+    n_states and n_actions: the shape of the equivalent dense table
+    default: the value of every entry before it's written to
+    block_size: rows are stored in float32 blocks of this many rows, allocated as they're needed
+    max_rows: optionally, the most rows to keep. When the table is full, the least recently used row is
+    evicted (and goes back to the default values) to make space for a new one.
+    '''
+    def __init__(self, n_states, n_actions, default=0, block_size=4096, max_rows=None):
+        self.shape = (int(n_states), int(n_actions))
+        self.default = default
+        self.block_size = block_size
+        self.max_rows = max_rows
+        self._blocks = []
+        self._slots = OrderedDict() # Maps each stored state to its slot, in order of use
+        self._free = [] # Slots of evicted rows, to be reused
+        self._default_row = np.full(n_actions, default, dtype=np.float32)
+        self._default_row.flags.writeable = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _row(self, slot):
+        block, i = divmod(slot, self.block_size)
+        return self._blocks[block][i]
+
+    '''
+    Returns the slot of a stored state, or None. Lookups count towards the hit rate.
+    '''
+    def _lookup(self, state):
+        slot = self._slots.get(state)
+        if slot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.max_rows is not None:
+                self._slots.move_to_end(state)
+        return slot
+
+    '''
+    Returns the slot of a state, storing a new default row for it if it isn't stored yet
+    '''
+    def _allocate(self, state):
+        slot = self._slots.get(state)
+        if slot is not None:
+            if self.max_rows is not None:
+                self._slots.move_to_end(state)
+            return slot
+        if self.max_rows is not None and len(self._slots) >= self.max_rows:
+            _, free = self._slots.popitem(last=False)
+            self._free.append(free)
+            self.evictions += 1
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._slots)
+            if slot == len(self._blocks) * self.block_size:
+                self._blocks.append(np.empty((self.block_size, self.shape[1]), dtype=np.float32))
+        self._row(slot)[:] = self.default
+        self._slots[state] = slot
+        return slot
+
+    '''
+    q_table[state] is a row and q_table[state, action] is a single value. Arrays of states (and actions) give arrays
+    of rows (and values), like fancy indexing. For a state that hasn't been written to yet, the row is a fresh copy
+    of the default row, which is only stored if it's assigned back, so q_table[state] += x works like it does on a
+    dense table without storing rows that are only read.
+    '''
+    def __getitem__(self, key):
+        state, action = key if isinstance(key, tuple) else (key, None)
+        if np.ndim(state) > 0:
+            rows = np.stack([self[s] for s in np.asarray(state).tolist()])
+            return rows if action is None else rows[np.arange(len(rows)), action]
+        slot = self._lookup(int(state))
+        if slot is None:
+            return self._default_row.copy() if action is None else self._default_row[action]
+        row = self._row(slot)
+        return row if action is None else row[action]
+
+    def __setitem__(self, key, value):
+        state, action = key if isinstance(key, tuple) else (key, slice(None))
+        if np.ndim(state) > 0:
+            states = np.asarray(state).tolist()
+            actions = [action] * len(states) if isinstance(action, slice) else np.broadcast_to(action, len(states))
+            values = np.broadcast_to(value, (len(states),) + np.shape(value)[1:])
+            for s, a, v in zip(states, actions, values):
+                self[s, a] = v
+            return
+        self._row(self._allocate(int(state)))[action] = value
+
+    def __len__(self):
+        return len(self._slots)
+
+    '''
+    The number of bytes allocated to the blocks of rows and (roughly) to the index of stored states
+    '''
+    def memory(self):
+        blocks = sum(block.nbytes for block in self._blocks)
+        # An OrderedDict entry costs around 100 bytes, plus the int objects for the state and slot
+        index = len(self._slots) * 150
+        return blocks + index
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def stats(self):
+        return {'rows': len(self._slots),
+                'memory': self.memory(),
+                'dense_memory': self.shape[0] * self.shape[1] * 8,
+                'hit_rate': self.hit_rate(),
+                'evictions': self.evictions}
+
+if __name__ == '__main__':
+    import gymnasium as gym
+    import example_envs
+    import time
+
+    env = gym.make('example_envs/GridWorld-v0', size=100, max_episode_steps=2000)
+    q_table = SparseQTable(env.observation_space.n, env.action_space.n, max_rows=10 ** 6)
+
+    alpha = 0.1
+    gamma = 1
+    epsilon = 0.1
+
+    t = time.time()
+    for episode in range(1, 201):
+        state, info = env.reset(seed=episode)
+        done = False
+        while not done:
+            if np.random.uniform() < epsilon:
+                action = env.action_space.sample()
+            else:
+                action = np.argmax(q_table[state])
+            next_state, reward, terminated, truncated, info = env.step(action)
+            done = terminated or truncated
+            target = reward + gamma * np.max(q_table[next_state]) * (not terminated)
+            q_table[state, action] = (1 - alpha) * q_table[state, action] + alpha * target
+            state = next_state
+    print(f"{round(time.time() - t, 2)}s, {q_table.stats()}")
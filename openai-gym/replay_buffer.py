@@ -0,0 +1,168 @@
+'''
+Experience replay for tabular Q-learning, as in my_gridworld.py and my_gridworld_vector.py.
+Transitions are kept in a fixed-size ring buffer of preallocated numpy columns (states, actions, rewards,
+next states and dones), so storing one is a few array writes rather than a new Python object. Once the buffer is
+full, the oldest transitions are overwritten. Batches are sampled uniformly and applied to the Q table in one go.
+The columns can be backed by .npy files on disk through np.memmap, so a buffer much larger than RAM can be kept
+between runs and replayed offline: only the pages that are touched are read in.
+'''
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'dones')
+
+class ReplayBuffer:
+    '''
+    capacity: the most transitions to keep
+    path: optionally, a directory to keep the columns in as memory-mapped .npy files. If it already holds a buffer,
+    that buffer is opened (and its capacity is used), so it can be added to or replayed.
+    state_dtype: the integer type of the states. np.int32 halves the size of the state columns for environments with
+    fewer than 2^31 states.
+    '''
+    def __init__(self, capacity, path=None, state_dtype=np.int64):
+        dtypes = {'states': state_dtype, 'actions': np.int8, 'rewards': np.float32,
+                  'next_states': state_dtype, 'dones': bool}
+        self.path = path
+        self.size = 0
+        self.position = 0 # Where the next transition is written
+        if path is not None and os.path.exists(os.path.join(path, 'meta.json')):
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            capacity, self.size, self.position = meta['capacity'], meta['size'], meta['position']
+            for name in COLUMNS:
+                setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r+'))
+        elif path is not None:
+            os.makedirs(path, exist_ok=True)
+            for name in COLUMNS:
+                setattr(self, name, np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+',
+                                                              dtype=dtypes[name], shape=(capacity,)))
+            self.flush()
+        else:
+            for name in COLUMNS:
+                setattr(self, name, np.zeros(capacity, dtype=dtypes[name]))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    '''
+    Add a batch of transitions, e.g. one step of a vector environment. Each argument is an array (or a scalar,
+    which is used for the whole batch). A batch larger than the capacity only keeps its last capacity transitions.
+    '''
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        n = len(states)
+        # Wrapping around the end of the buffer is just a modular index
+        i = (self.position + np.arange(max(0, n - self.capacity), n)) % self.capacity
+        for name, values in zip(COLUMNS, (states, actions, rewards, next_states, dones)):
+            values = np.broadcast_to(values, n)
+            getattr(self, name)[i] = values[n - len(i):]
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    '''
+    batch_size transitions drawn uniformly (with replacement) using rng, a numpy Generator, as a tuple of arrays in
+    the order of COLUMNS
+    '''
+    def sample(self, batch_size, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        i = rng.integers(0, self.size, size=batch_size)
+        return tuple(getattr(self, name)[i] for name in COLUMNS)
+
+    '''
+    Yields every stored transition, oldest first, in chunks of chunk_size as tuples of arrays.
+    With a memory-mapped buffer only one chunk at a time is read in.
+    '''
+    def chunks(self, chunk_size=1 << 20):
+        start = self.position - self.size
+        for first in range(start, self.position, chunk_size):
+            i = np.arange(first, min(first + chunk_size, self.position)) % self.capacity
+            yield tuple(getattr(self, name)[i] for name in COLUMNS)
+
+    '''
+    Write the memory-mapped columns back to disk along with the size and position, so the buffer can be opened again.
+    Does nothing for a buffer in memory.
+    '''
+    def flush(self):
+        if self.path is None:
+            return
+        for name in COLUMNS:
+            getattr(self, name).flush()
+        meta = {'capacity': len(self.states), 'size': self.size, 'position': self.position}
+        with open(os.path.join(self.path, 'meta.tmp.json'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, 'meta.tmp.json'), os.path.join(self.path, 'meta.json'))
+
+'''
+Apply one Q-learning update for each transition in a batch, all at once. If the batch holds the same
+(state, action) more than once, only one of its updates is kept, like the updates in my_gridworld_vector.py.
+'''
+def q_update_batch(q_table, states, actions, rewards, next_states, dones, alpha=0.1, gamma=1):
+    target = rewards + gamma * np.max(q_table[next_states], axis=1) * ~dones
+    q_table[states, actions] = (1 - alpha) * q_table[states, actions] + alpha * target
+
+'''
+Offline replay: sweep the Q table over every transition in the buffer, passes times, chunk by chunk
+'''
+def replay(q_table, buffer, passes=1, chunk_size=1 << 16, alpha=0.1, gamma=1):
+    for _ in range(passes):
+        for batch in buffer.chunks(chunk_size):
+            q_update_batch(q_table, *batch, alpha=alpha, gamma=gamma)
+
+if __name__ == '__main__':
+    import gymnasium as gym
+    import example_envs
+
+    parser = argparse.ArgumentParser(description="Collect gridworld transitions into a replay buffer and learn from them")
+    parser.add_argument('--path', help="keep the buffer in this directory, memory-mapped")
+    parser.add_argument('--capacity', type=int, default=10 ** 7)
+    parser.add_argument('--steps', type=int, default=2000, help="steps of the vector environment to collect")
+    parser.add_argument('--batch-size', type=int, default=1024, help="transitions replayed after each step")
+    parser.add_argument('--offline-passes', type=int, default=1, help="passes over the whole buffer afterwards")
+    args = parser.parse_args()
+
+    env = gym.make_vec('example_envs/GridWorld-v0', num_envs=1024)
+    n_states, n_actions = env.single_observation_space.n, env.single_action_space.n
+    q_table = np.zeros([n_states, n_actions])
+    buffer = ReplayBuffer(args.capacity, args.path, state_dtype=np.int32)
+    print(f"Opened a buffer of {len(buffer)} transitions")
+
+    # Online: behave epsilon-greedily, store every transition and replay a uniform batch after each step
+    rng = np.random.default_rng(0)
+    t = time.time()
+    state, info = env.reset(seed=0)
+    for _ in range(args.steps):
+        action = np.argmax(q_table[state], axis=1)
+        explore = rng.random(env.num_envs) < 0.1
+        action[explore] = rng.integers(0, n_actions, size=np.count_nonzero(explore))
+        next_state, reward, terminated, truncated, info = env.step(action)
+        # Finished worlds have already been reset, so store the last observation of their episode
+        last_state = np.where(info['_final_obs'], info['final_obs'], next_state) if 'final_obs' in info else next_state
+        buffer.add_batch(state, action, reward, last_state, terminated)
+        q_update_batch(q_table, *buffer.sample(args.batch_size, rng))
+        state = next_state
+    env.close()
+    buffer.flush()
+    print(f"Collected {args.steps * env.num_envs} transitions in {round(time.time() - t, 2)}s, "
+          f"buffer holds {len(buffer)}")
+
+    # Offline: start a fresh table and learn from the stored transitions alone
+    q_table = np.zeros([n_states, n_actions])
+    t = time.time()
+    replay(q_table, buffer, args.offline_passes)
+    print(f"Replayed {len(buffer) * args.offline_passes} transitions offline in {round(time.time() - t, 2)}s")